@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Measure the cost per value of converting clip time strings, comparing the
+parsers that were copied into stats.py, compute_seconds.py and
+compute_frames.py with the shared ones in timecode.py, and with
+bulk_timecode.convert, which does a whole column at once.
+"""
+
+import argparse
+import random
+import re
+import timeit
+
+import bulk_timecode
+import timecode
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-n', '--count', type=int, default=100000,
+                        help='Number of time strings converted per run. '
+                        'default: %(default)s')
+
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs per function, the fastest is reported. '
+                        'default: %(default)s')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    times = make_times(args.count)
+    cases = [
+        ('to_seconds', legacy_to_seconds, timecode.to_seconds),
+        ('to_frames', legacy_to_start_frame, timecode.to_frames),
+    ]
+    print(f'{"function":<12s}\t{"before ns":>10s}\t{"after ns":>10s}\tspeedup')
+    for (name, before, after) in cases:
+        before_ns = ns_per_value(before, times, args.repeat)
+        after_ns = ns_per_value(after, times, args.repeat)
+        print(f'{name:<12s}\t{before_ns:10.0f}\t{after_ns:10.0f}\t{before_ns / after_ns:.1f}x')
+    # Both frames and seconds come out of one call.
+    bulk_ns = min(timeit.repeat(lambda: bulk_timecode.convert(times),
+                                number=1, repeat=args.repeat)) * 1e9 / len(times)
+    print(f'{"convert":<12s}\t{"":>10s}\t{bulk_ns:10.0f}')
+
+
+def make_times(count):
+    """
+    Returns count random time strings, in the S:FF, M:SS:FF and H:MM:SS:FF
+    forms in about the proportions found in the clips table.
+    """
+    rnd = random.Random(1)
+    times = []
+    for _ in range(count):
+        frames = rnd.choice([rnd.randrange(30 * 60), rnd.randrange(30 * 60 * 60),
+                             rnd.randrange(30 * 60 * 60 * 3)])
+        (rest, frame) = divmod(frames, 30)
+        (rest, sec) = divmod(rest, 60)
+        (hour, minute) = divmod(rest, 60)
+        if hour:
+            times.append(f'{hour}:{minute:02d}:{sec:02d}:{frame:02d}')
+        elif minute:
+            times.append(f'{minute}:{sec:02d}:{frame:02d}')
+        else:
+            times.append(f'{sec}:{frame:02d}')
+    return times
+
+
+def ns_per_value(function, times, repeat):
+    """
+    Returns the best time in ns to run function on one value.
+    """
+    best = min(timeit.repeat(lambda: [function(time) for time in times],
+                             number=1, repeat=repeat))
+    return best * 1e9 / len(times)
+
+
+def legacy_to_seconds(string):
+    """
+    stats.check_seconds as it was before timecode.py: up to three
+    re.match calls with patterns compiled on each call.
+    """
+    match = re.match(r'^(\d?\d):(\d\d)$', string)
+    if match:
+        hour = 0
+        minutes = 0
+        sec = match.group(1)
+        frame = match.group(2)
+    else:
+        match = re.match(r'^(\d?\d):(\d\d):(\d\d)$', string)
+        if match:
+            hour = 0
+            minutes = match.group(1)
+            sec = match.group(2)
+            frame = match.group(3)
+        else:
+            match = re.match(r'^(\d?\d):(\d\d):(\d\d):(\d\d)$', string)
+            if match:
+                hour = match.group(1)
+                minutes = match.group(2)
+                sec = match.group(3)
+                frame = match.group(4)
+            else:
+                raise SyntaxError(f"Didn't match: {string=}")
+    if int(frame) >= 30:
+        raise SyntaxError(f'Frame too large: {frame} in {string}')
+    return (int(hour) * 60 + int(minutes)) * 60 + int(sec) + (int(frame) / 30.0)
+
+
+def legacy_to_start_frame(start_time):
+    """
+    stats.to_start_frame as it was before timecode.py.
+    """
+    times = [1, 30, 30 * 60, 30 * 60 * 60]
+    time_index = 0
+    start_frame = 0
+    for part in reversed(start_time.split(':')):
+        start_frame += int(part) * times[time_index]
+        time_index += 1
+    return start_frame
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Measure the time arithmetic in video_clip.py: to_frame, from_frame,
+normalize_time, subtract_time and array_to_time.
+
+Each runs over a corpus of random times plus edge cases like 0, SS:FF
+and hour rollovers. Reported are the ns per call and the bytes allocated
+per call, the highest point tracemalloc sees above where the call started,
+both compared with the baseline file. Save a baseline with --save before
+a change, and run again after it. The exit status is 1 when a function
+got slower by more than --tolerance percent or allocates more. The times
+depend on the machine, so no baseline comes with the code. Without one
+the results are only shown.
+
+video_clip.py needs pyperclip, see requirements.txt.
+"""
+
+import argparse
+import json
+from pathlib import Path
+import random
+import sys
+import timeit
+import tracemalloc
+
+from bench_timecode import make_times
+import video_clip
+
+
+# Times that are not in the random corpus, or are easy to get wrong.
+EDGE_CASES = ['0', '0:00', '5:03', '0:29', '59:29', '1:00:00', '9:59:29', '10:00:00',
+              '59:59:29', '1:00:00:00', '0:00:00:00', '3:59:59:29']
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-n', '--count', type=int, default=100000,
+                        help='Number of random times in the corpus. '
+                        'default: %(default)s')
+
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs per function, the fastest is reported. '
+                        'default: %(default)s')
+
+    parser.add_argument('-b', '--baseline_file',
+                        default=str(Path(__file__).with_name('bench_video_clip.json')),
+                        help='JSON file holding the baseline results. '
+                        'default: %(default)s')
+
+    parser.add_argument('-s', '--save', action='store_true',
+                        help='Save the results as the new baseline.')
+
+    parser.add_argument('-t', '--tolerance', type=float, default=20,
+                        help='Percent slower than the baseline that is still not '
+                        'reported as a regression. '
+                        'default: %(default)s')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    results = {}
+    for (name, function, arguments) in make_cases(args.count):
+        results[name] = {'ns': ns_per_call(function, arguments, args.repeat),
+                         'bytes': bytes_per_call(function, arguments[:1000])}
+
+    baseline = {}
+    if Path(args.baseline_file).is_file():
+        with open(args.baseline_file, encoding='utf-8') as in_file:
+            baseline = json.load(in_file)
+    elif not args.save:
+        print(f'No baseline in {args.baseline_file}, use --save to make one')
+        print(f'{"function":<16s}\t{"ns":>8s}\t{"bytes":>6s}')
+        for (name, result) in results.items():
+            print(f'{name:<16s}\t{result["ns"]:8.0f}\t{result["bytes"]:6.0f}')
+        return
+    print(f'{"function":<16s}\t{"ns":>8s}\t{"base ns":>8s}\t{"change":>7s}'
+          f'\t{"bytes":>6s}\t{"base":>6s}')
+    regressions = []
+    for (name, result) in results.items():
+        base = baseline.get(name)
+        if base:
+            change = (result['ns'] / base['ns'] - 1) * 100
+            print(f'{name:<16s}\t{result["ns"]:8.0f}\t{base["ns"]:8.0f}\t{change:+6.0f}%'
+                  f'\t{result["bytes"]:6.0f}\t{base["bytes"]:6.0f}')
+            if change > args.tolerance or round(result['bytes']) > round(base['bytes']):
+                regressions.append(name)
+        else:
+            print(f'{name:<16s}\t{result["ns"]:8.0f}\t{"":>8s}\t{"":>7s}'
+                  f'\t{result["bytes"]:6.0f}')
+
+    if args.save:
+        with open(args.baseline_file, 'w', encoding='utf-8') as out_file:
+            json.dump(results, out_file, indent=2)
+        print(f'Saved baseline in {args.baseline_file}')
+    if regressions:
+        print(f'Regressions: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+def make_cases(count):
+    """
+    Returns (name, function, arguments) for each function measured, where
+    arguments is the list of argument tuples it is called with.
+    """
+    rnd = random.Random(2)
+    times = make_times(count) + EDGE_CASES
+    frames = [video_clip.to_frame(time) for time in times]
+    pairs = []
+    for (time, frame) in zip(times, frames):
+        pairs.append((time, video_clip.from_frame(rnd.randrange(frame + 1))))
+    arrays = []
+    for frame in frames:
+        (rest, frame) = divmod(frame, 30)
+        (rest, sec) = divmod(rest, 60)
+        (hour, minute) = divmod(rest, 60)
+        arrays.append(([hour, minute, sec, frame],))
+    return [
+        ('to_frame', video_clip.to_frame, [(time,) for time in times]),
+        ('from_frame', video_clip.from_frame, [(frame,) for frame in frames]),
+        # normalize_time needs at least 2 characters.
+        ('normalize_time', video_clip.normalize_time, [(time,) for time in times
+                                                       if len(time) > 1]),
+        ('subtract_time', video_clip.subtract_time, pairs),
+        ('array_to_time', video_clip.array_to_time, arrays),
+    ]
+
+
+def ns_per_call(function, arguments, repeat):
+    """
+    Returns the best time in ns to call function once.
+    """
+    best = min(timeit.repeat(lambda: [function(*values) for values in arguments],
+                             number=1, repeat=repeat))
+    return best * 1e9 / len(arguments)
+
+
+def bytes_per_call(function, arguments):
+    """
+    Returns the average of the most memory allocated during each call,
+    above what was allocated before it.
+    """
+    total = 0
+    tracemalloc.start()
+    for values in arguments:
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        function(*values)
+        total += tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return total / len(arguments)
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
@@ -0,0 +1,180 @@
+"""
+Convert whole columns of clip time strings with NumPy, for the programs
+that backfill duration_seconds and start_frame.
+
+This accepts the same strings as timecode.parse, but works on arrays
+instead of one value at a time, and marks the bad values in a mask
+instead of raising an exception.
+
+The strings are laid out as a grid of character codes. Each row is
+reduced to a key describing where its digits and colons are, which must
+be one of the SHAPES, and its digits are multiplied by the place values
+for that shape.
+"""
+
+import numpy as np
+
+from timecode import FPS, frame_rate
+
+
+# Digits in each part of the accepted forms, see timecode.parse.
+SHAPES = [
+    (1, 2), (2, 2),
+    (1, 2, 2), (2, 2, 2),
+    (1, 1, 2, 2), (1, 2, 2, 2), (2, 1, 2, 2), (2, 2, 2, 2),
+]
+# Longest accepted string, HH:MM:SS:FF.
+WIDTH = 11
+# What each character is.
+(PAD, DIGIT, COLON, OTHER) = range(4)
+# The kind of each character code, with OTHER at the end for everything
+# that is not ASCII.
+KINDS = np.full(129, OTHER, dtype=np.int64)
+KINDS[0] = PAD
+KINDS[ord('0'):ord('9') + 1] = DIGIT
+KINDS[ord(':')] = COLON
+
+
+def build_shapes():
+    """
+    Returns the key for each of the SHAPES and the place values of each
+    character position in it, as a (WIDTH, shapes * 4) array giving the
+    contribution to hours, minutes, seconds and frames for each shape.
+    """
+    keys = []
+    place_values = np.zeros((WIDTH, len(SHAPES), 4))
+    for (index, shape) in enumerate(SHAPES):
+        kinds = []
+        places = []
+        for (part, digits) in enumerate(shape):
+            if part:
+                kinds.append(COLON)
+                places.append(None)
+            # The last part is frames, the one before seconds and so on.
+            field = 4 - len(shape) + part
+            for place in range(digits):
+                kinds.append(DIGIT)
+                places.append((field, 10 ** (digits - 1 - place)))
+        for (position, place) in enumerate(places):
+            if place:
+                place_values[position, index, place[0]] = place[1]
+        keys.append(row_key(np.array(kinds + [PAD] * (WIDTH - len(kinds))))[()])
+    return (np.array(keys), place_values.reshape(WIDTH, -1))
+
+
+def row_key(kinds):
+    """
+    Turn each row of character kinds into one integer.
+    """
+    return kinds @ (4 ** np.arange(kinds.shape[-1], dtype=np.int64))
+
+
+(SHAPE_KEYS, PLACE_VALUES) = build_shapes()
+
+
+def convert(time_strings, fps=FPS, duration=False):
+    """
+    Convert a sequence of time strings, all from videos with the given fps,
+    which are durations if duration is True, see timecode.to_frames.
+    Returns (frames, seconds, valid) arrays. frames and seconds are 0
+    where valid is False. None values are not valid, nor is any value
+    with an fps that timecode.frame_rate rejects.
+    """
+    strings = np.asarray(time_strings, dtype=str)
+    count = len(strings)
+    try:
+        (nominal, drop) = frame_rate(fps)
+    except ValueError:
+        return (np.zeros(count, dtype=np.int64), np.zeros(count), np.zeros(count, dtype=bool))
+    if not count:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=bool))
+    codes = strings.view(np.uint32).reshape(count, -1)
+    # One column more than the longest accepted string shows what is too long.
+    if codes.shape[1] <= WIDTH:
+        codes = np.pad(codes, ((0, 0), (0, WIDTH + 1 - codes.shape[1])))
+    too_long = codes[:, WIDTH] != 0
+    codes = codes[:, :WIDTH]
+
+    keys = row_key(KINDS[np.minimum(codes, 128)])
+    order = np.argsort(SHAPE_KEYS)
+    shape_index = order[np.searchsorted(SHAPE_KEYS, keys, sorter=order).clip(0, len(order) - 1)]
+    valid = (SHAPE_KEYS[shape_index] == keys) & ~too_long
+
+    # Every shape at once, then keep the one that matched. The place values
+    # are 0 for colons and padding. Doubles hold these integers exactly.
+    every_shape = (codes.astype(np.float64) - ord('0')) @ PLACE_VALUES
+    columns = shape_index[:, np.newaxis] * 4 + np.arange(4)
+    fields = np.take_along_axis(every_shape, columns, axis=1).astype(np.int64)
+    (hour, minute, sec, frame) = fields.T
+    if duration:
+        drop = 0
+    valid &= frame < nominal
+    if drop:
+        valid &= ~((frame < drop) & (sec == 0) & (minute % 10 != 0))
+    fields[~valid] = 0
+
+    minutes = hour * 60 + minute
+    frames = (minutes * 60 + sec) * nominal + frame - drop * (minutes - minutes // 10)
+    if fps is None or (fps == nominal and not drop):
+        seconds = minutes * 60 + sec + frame / float(nominal)
+    else:
+        seconds = frames / fps
+    return (frames, seconds, valid)
+
+
+def convert_by_fps(time_strings, fps_values, duration=False):
+    """
+    Convert time strings from videos with different frame rates, where
+    fps_values gives the fps of the video of each one. The strings of each
+    frame rate are converted together.
+    Returns (frames, seconds, valid) arrays like convert.
+    """
+    time_strings = np.asarray(time_strings, dtype=str)
+    fps_values = np.asarray(fps_values, dtype=np.float64)
+    frames = np.zeros(len(time_strings), dtype=np.int64)
+    seconds = np.zeros(len(time_strings))
+    valid = np.zeros(len(time_strings), dtype=bool)
+    for fps in np.unique(fps_values):
+        rows = fps_values == fps
+        (frames[rows], seconds[rows], valid[rows]) = convert(time_strings[rows], float(fps),
+                                                             duration)
+    return (frames, seconds, valid)
+
+
+def fetch_columns(con, sql, values=()):
+    """
+    Run a query and return each column of the result as an array.
+    """
+    cur = con.execute(sql, values)
+    rows = cur.fetchall()
+    return [np.array([row[index] for row in rows]) for index in range(len(cur.description))]
+
+
+def backfill(con, column, source, chunk_size, seconds=False, duration=False):
+    """
+    Fill in the NULL values of clips.column from the time strings in
+    clips.source and the fps of their videos, chunk_size clips at a time
+    in id order. Each chunk is
+    written with one executemany and committed, so memory use does not
+    grow with the table, and an interrupted run picks up after the last
+    committed chunk when run again. Fills in frames, or seconds if
+    seconds is True. duration tells that source holds durations.
+    Yields (last_id, updated, bad) after each chunk, where bad lists the
+    (id, time string) of the clips in it that did not convert.
+    """
+    select = f"""SELECT clips.id, {source}, coalesce(fps, {FPS})
+FROM clips LEFT JOIN videos ON videos.id = video_id
+WHERE {column} IS NULL AND clips.id > ? ORDER BY clips.id LIMIT ?"""
+    update = f'UPDATE clips SET {column} = ? WHERE id = ?'
+    last_id = -1
+    while True:
+        (ids, time_strings, fps_values) = fetch_columns(con, select, (last_id, chunk_size))
+        if not len(ids):
+            break
+        (frames, seconds_values, valid) = convert_by_fps(time_strings, fps_values, duration)
+        values = seconds_values if seconds else frames
+        con.executemany(update, zip(values[valid].tolist(), ids[valid].tolist()))
+        con.commit()
+        last_id = int(ids[-1])
+        yield (last_id, int(valid.sum()),
+               list(zip(ids[~valid].tolist(), time_strings[~valid].tolist())))
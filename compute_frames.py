@@ -5,6 +5,11 @@ Run theough the clips table computing start_frame from the start_time field.
 
 import argparse
 import sqlite3
+import sys
+
+from bulk_timecode import backfill
+from schema import add_columns
+from timecode import register_functions
 
 
 def build_parser():
@@ -19,6 +24,12 @@ def build_parser():
                         help='File name of the SQlite database file. '
                         'default: %(default)s')
 
+    parser.add_argument('-c', '--chunk_size', type=int, default=0,
+                        help='Convert and commit this many clips at a time, reporting '
+                        'progress after each chunk. An interrupted run goes on from '
+                        'the last chunk committed. 0 does all of them in one UPDATE. '
+                        'default: %(default)s')
+
     return parser
 
 
@@ -26,43 +37,39 @@ def main(args):
     """
     Main processing function.
     """
-    con = db_open(args.dtatbase_file)
-    sql = 'SELECT id,start_time FROM clips WHERE start_frame IS NULL'
-    cur = con.cursor()
-    cur.execute(sql)
-    pairs = []
-    while True:
-        results = cur.fetchone()
-        if not results:
-            break
-        pairs.append((results[0], to_start_frame(results[1])))
-
-    sql = 'UPDATE clips SET start_frame = :start_frame WHERE id = :id'
-    for (clips_id, start_frame) in pairs:
-        con.execute(sql, {'id': clips_id, 'start_frame': start_frame})
-    con.commit()
-    print(len(pairs))
-
-
-m = [1, 30, 30 * 60, 30 * 60 * 60]
-
-def to_start_frame(start_time):
-    """
-    Convert start_time to start_frame.
-    """
-    i = 0
-    start_frame = 0
-    for part in reversed(start_time.split(':')):
-        start_frame += int(part) * m[i]
-        i += 1
-    return start_frame
+    con = db_open(args.database_file)
+    add_columns(con, 'videos', [('fps', 'REAL')])
+    if args.chunk_size > 0:
+        updated = 0
+        bad = []
+        for (last_id, chunk_updated, chunk_bad) in backfill(con, 'start_frame', 'start_time',
+                                                            args.chunk_size, seconds=False):
+            updated += chunk_updated
+            bad += chunk_bad
+            sys.stderr.write(f'Up to clip id={last_id}: {updated} updated\n')
+    else:
+        # At the fps of the video, like backfill and the triggers of schema.py.
+        fps = '(SELECT fps FROM videos WHERE videos.id = clips.video_id)'
+        sql = f"""UPDATE clips SET start_frame = tc_frames(start_time, {fps})
+WHERE start_frame IS NULL"""
+        updated = con.execute(sql).rowcount
+        con.commit()
+        # tc_frames is NULL for the ones that did not convert.
+        sql = 'SELECT id,start_time FROM clips WHERE start_frame IS NULL'
+        bad = con.execute(sql).fetchall()
+        updated -= len(bad)
+    for (clip_id, start_time) in bad:
+        print(f"Didn't match: {start_time} clip id={clip_id}")
+    print(updated)
+    if bad:
+        sys.exit(1)
 
 
 def db_open(db_file):
     """
     Open the database and return a connection object.
     """
-    return sqlite3.connect(db_file)
+    return register_functions(sqlite3.connect(db_file))
 
 
 if __name__ == '__main__':
@@ -1,13 +1,50 @@
 #!/usr/bin/env python
 """
 Run through the videos table computing the md5 checksum for the file and store it.
+
+Faster algorithms can be picked with --algorithm. Their digests go in the
+digest column, with the algorithm name in digest_algorithm, leaving the
+md5 column as it is.
+
+Use --max_mb_per_sec to run it in the background without taking all of
+the disk bandwidth. On Linux the kernel is also told the files are read
+once, sequentially, so they do not push everything else out of the cache.
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import hashlib
+import mmap
+import os
 from pathlib import Path
 import sqlite3
 import sys
+import time
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from duplicate_report import report_duplicates
+from schema import add_columns, table_columns
+
+
+MEGABYTE = 1024 * 1024
+
+ALGORITHMS = {
+    'md5': hashlib.md5,
+    'blake2b': hashlib.blake2b,
+}
+if xxhash:
+    ALGORITHMS.update({
+        'xxh64': xxhash.xxh64,
+        'xxh3_64': xxhash.xxh3_64,
+        'xxh3_128': xxhash.xxh3_128,
+    })
+
+# The RateLimiter for this process, set up by init_limiter.
+limiter = None
 
 
 def build_parser():
@@ -27,6 +64,37 @@ def build_parser():
                         help='Directory where videos are located. '
                         'default: %(default)s')
 
+    parser.add_argument('-a', '--algorithm', choices=sorted(ALGORITHMS), default='md5',
+                        help='Hash algorithm. The xxh ones need the xxhash package. '
+                        'default: %(default)s')
+
+    parser.add_argument('-b', '--block_size', type=int, default=1024,
+                        help='Size in KB of the buffer used to read each file. '
+                        'default: %(default)s')
+
+    parser.add_argument('-m', '--mmap_threshold', type=int, default=256,
+                        help='Files of at least this many MB are memory mapped '
+                        'instead of read. 0 turns this off. '
+                        'default: %(default)s')
+
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes hashing files at the same time. '
+                        'default: %(default)s')
+
+    parser.add_argument('--batch_size', type=int, default=100,
+                        help='Number of digests written per transaction. '
+                        'default: %(default)s')
+
+    parser.add_argument('--max_mb_per_sec', type=float, default=0,
+                        help='Read at most this many MB per second, shared by all '
+                        'of the --jobs. 0 means no limit. '
+                        'default: %(default)s')
+
+    parser.add_argument('--verify', action='store_true', default=False,
+                        help='Read every file again even when the fingerprint cache '
+                        'has its digest, reporting any that changed. '
+                        'default: %(default)s')
+
     return parser
 
 
@@ -35,74 +103,339 @@ def main(args):
     Main processing function.
     """
     con = db_open(args.database_file)
-    # Make sure every video has an MD5 value.
-    sql = "SELECT id,filename FROM videos WHERE md5 IS NULL OR md5 =''"
+    create_fingerprints(con)
+    add_columns(con, 'videos', [('digest', 'TEXT'), ('digest_algorithm', 'TEXT')])
+    # One listing of the directory tells which videos exist and gives
+    # their signatures, without opening any of them.
+    on_disk = {os.path.normcase(entry.name): entry
+               for entry in os.scandir(args.videos_dir) if entry.is_file()}
+    # Make sure every video has a digest.
+    (sql, _, _) = digest_sql(args.algorithm)
     cur = con.cursor()
-    cur.execute(sql)
+    cur.execute(sql, {'algorithm': args.algorithm})
     count = 0
     bad_ids = []
-    for results in cur.fetchall():
+    tasks = []
+    cached = {}
+    for (video_id, filename) in cur.fetchall():
         count += 1
         if count % 100 == 0:
             sys.stderr.write('.')
-        (video_id, filename) = results
-        try:
-            path = Path(args.videos_dir) / filename
-            with open(str(path)) as in_file:
-                pass
-        except:
+        entry = on_disk.get(os.path.normcase(filename))
+        if entry is None:
             if not bad_ids:
                 print('No such file:')
             print(video_id,filename)
             bad_ids.append(video_id)
+            continue
+        path = str(Path(args.videos_dir) / filename)
+        signature = entry_signature(entry)
+        digest = lookup_fingerprint(con, signature, args.algorithm)
+        if digest:
+            cached[video_id] = digest
+        tasks.append((video_id, filename, path, signature, args.algorithm,
+                      args.block_size * 1024, args.mmap_threshold * MEGABYTE))
     sys.stderr.write('\n')
     if bad_ids:
         print(f"Mismatched counts: {len(bad_ids)}")
-    cur.execute(sql)
+    throughput = Throughput()
+    to_hash = tasks if args.verify else [task for task in tasks if task[0] not in cached]
+    bytes_per_second = args.max_mb_per_sec * MEGABYTE / max(args.jobs, 1)
+    if args.jobs > 1:
+        # map() hands back the results in task order, whichever process
+        # finishes first, so the output does not depend on timing.
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_limiter,
+                                 initargs=(bytes_per_second,)) as executor:
+            results = with_cached(tasks, cached, executor.map(hash_video, to_hash), args.verify)
+            store_digests(con, results, args.algorithm, args.batch_size, throughput)
+    else:
+        init_limiter(bytes_per_second)
+        results = with_cached(tasks, cached, map(hash_video, to_hash), args.verify)
+        store_digests(con, results, args.algorithm, args.batch_size, throughput)
+    sys.stderr.write('\n')
+    throughput.report()
+
+    # Look for the videos with duplicate digests.
+    report_duplicates(con, sys.stdout, algorithm=args.algorithm)
+
+
+def digest_sql(algorithm):
+    """
+    Returns the statements that select the videos without a digest, find
+    the videos with a given digest and store a digest, for algorithm.
+    MD5 digests stay in the md5 column, the others go in digest, tagged
+    with the algorithm.
+    """
+    if algorithm == 'md5':
+        return ("SELECT id,filename FROM videos WHERE md5 IS NULL OR md5 ='' ORDER BY id",
+                'SELECT id,filename FROM videos WHERE md5 = :digest ORDER BY id',
+                'UPDATE videos SET md5 = :digest WHERE id = :id')
+    return ("SELECT id,filename FROM videos WHERE digest IS NULL OR digest = '' "
+            "OR digest_algorithm IS NOT :algorithm ORDER BY id",
+            'SELECT id,filename FROM videos '
+            'WHERE digest = :digest AND digest_algorithm = :algorithm ORDER BY id',
+            'UPDATE videos SET digest = :digest, digest_algorithm = :algorithm WHERE id = :id')
+
+
+def with_cached(tasks, cached, hashed, verify):
+    """
+    Yield a result for every task, in task order. Digests found in the
+    fingerprint cache are used as is, the rest come from hashed. When
+    verifying, every task was hashed and the cached value is compared.
+    """
+    hashed = iter(hashed)
+    for (video_id, filename, _, signature, _, _, _) in tasks:
+        if video_id in cached and not verify:
+            yield (video_id, filename, cached[video_id], signature, None, 0.0, 0.0, None)
+            continue
+        result = next(hashed)
+        if video_id in cached and result[2] and cached[video_id] != result[2]:
+            print(f'{filename} changed: cached digest {cached[video_id]}, now {result[2]}')
+        yield result
+
+
+def store_digests(con, results, algorithm, batch_size, throughput):
+    """
+    The single writer for the hashing results. Each result is checked for a
+    duplicate digest and stored, along with its fingerprint, committing once
+    every batch_size videos. Videos that could not be read are reported
+    and left without a digest.
+    """
+    (_, duplicate_sql, update_sql) = digest_sql(algorithm)
+    cur = con.cursor()
     count = 0
-    for results in cur.fetchall():
+    for (video_id, filename, digest, signature, size, seconds, throttled, error) in results:
+        if error:
+            print(f'Could not read {filename}: {error}')
+            continue
+        if size is None:
+            throughput.cached += 1
+        else:
+            throughput.add(size, seconds, throttled)
         count += 1
         if count % 100 == 0:
             sys.stderr.write('.')
-            con.commit()
-        (video_id, filename) = results
-        if id in bad_ids:
-            print('skipping',video_id,filename)
-            continue
-        path = Path(args.videos_dir) / filename
-        with open(str(path)) as in_file:
-            md5_hash = hashlib.md5()
-            for line in in_file:
-                md5_hash.update(line)
-        md5 = md5_hash.hexdigest()
-        sql = 'SELECT id,filename FROM videos WHERE md5 = :md5'
-        cur.execute(sql, {'md5':  md5})
-        for results in cur.fetchall():
-            (dup_id, dup_filename) = results
+        values = {'id': video_id, 'digest': digest, 'algorithm': algorithm}
+        cur.execute(duplicate_sql, values)
+        for (dup_id, dup_filename) in cur.fetchall():
             print(f'while processing {filename}')
-            print(f'duplicate MD5 {md5} for {dup_id}, file {dup_filename}')
-        args = {'id': id, 'md5': md5}
-        sql = 'UPDATE videos SET md5 = :md5 WHERE id = :id'
-        con.execute(sql, args)
-        con.commit()
-    sys.stderr.write('\n')
+            print(f'duplicate {algorithm.upper()} {digest} for {dup_id}, file {dup_filename}')
+        cur.execute(update_sql, values)
+        store_fingerprint(cur, signature, digest, algorithm)
+        if count % batch_size == 0:
+            con.commit()
+    con.commit()
+
 
-    # Look for the videos with duplicate md5 values.
-    sql = 'SELECT md5,count(*) FROM videos GROUP BY md5 HAVING count(*)>1'
-    cur.execute(sql)
-    first_time = True
-    for (md5, _) in cur.fetchall():
-        if first_time:
-            print('Duplicate md5')
-            first_time = False
-        sql = "SELECT id,filename,comment FROM videos WHERE md5 = :md5 and comment NOT LIKE 'dup%'"
-        cur.execute(sql, {'md5': md5})
-        dups = []
-        for (dup_id, dup_filename, dup_comment) in cur.fetchall():
-            dups.append([dup_id, dup_filename, dup_comment])
-        if len(dups) > 1:
-            for (dup_id, dup_filename, dup_comment) in dups:
-                print('|'.join([str(field) for field in [dup_id, dup_comment, dup_filename]]))
+def hash_video(task):
+    """
+    Hash one video. This runs in a worker process when --jobs is used, so it
+    takes and returns plain tuples. A file that cannot be read, because it
+    vanished or is not readable, gives a result with no digest and the
+    error, so that it does not stop the other videos.
+    """
+    (video_id, filename, path, signature, algorithm, block_size, mmap_threshold) = task
+    start = time.perf_counter()
+    throttled = limiter.throttled if limiter else 0.0
+    try:
+        (digest, size) = hash_file(path, block_size, mmap_threshold, algorithm, limiter)
+    except OSError as arg:
+        return (video_id, filename, None, signature, 0, time.perf_counter() - start, 0.0,
+                str(arg))
+    throttled = (limiter.throttled if limiter else 0.0) - throttled
+    return (video_id, filename, digest, signature, size, time.perf_counter() - start,
+            throttled, None)
+
+
+def init_limiter(bytes_per_second):
+    """
+    Set up the RateLimiter for this process. Each of the --jobs processes
+    gets its share of the total rate.
+    """
+    global limiter
+    limiter = RateLimiter(bytes_per_second) if bytes_per_second > 0 else None
+
+
+class RateLimiter():
+    """
+    Token bucket limiting the number of bytes read per second. The bucket
+    holds at most one second worth of bytes.
+    """
+    def __init__(self, bytes_per_second):
+        """
+        Start with an empty bucket, so the limit holds from the first block.
+        """
+        self.rate = bytes_per_second
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.throttled = 0.0
+
+    def consume(self, count):
+        """
+        Take count bytes from the bucket, sleeping if it ran dry.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate) - count
+        self.last = now
+        if self.tokens < 0:
+            wait = -self.tokens / self.rate
+            time.sleep(wait)
+            self.throttled += wait
+
+
+def create_fingerprints(con):
+    """
+    Create the file_fingerprints table if it is not there. It maps the stat
+    signature of a file and an algorithm to the digest, so a file that has
+    not changed since it was hashed, even if renamed, does not need to be
+    read again.
+    """
+    sql = """CREATE TABLE IF NOT EXISTS file_fingerprints (
+    device INTEGER,
+    inode INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER,
+    algorithm TEXT,
+    digest TEXT,
+    PRIMARY KEY (device, inode, size, mtime_ns, algorithm))"""
+    columns = table_columns(con, 'file_fingerprints')
+    if columns and 'algorithm' not in columns:
+        # Older table holding only MD5s. Copy them into the new layout.
+        con.execute('ALTER TABLE file_fingerprints RENAME TO file_fingerprints_md5')
+        con.execute(sql)
+        con.execute("""INSERT INTO file_fingerprints
+    SELECT device, inode, size, mtime_ns, 'md5', md5 FROM file_fingerprints_md5""")
+        con.execute('DROP TABLE file_fingerprints_md5')
+    else:
+        con.execute(sql)
+    con.commit()
+
+
+def file_signature(stat):
+    """
+    Returns the (device, inode, size, mtime_ns) key for an os.stat result.
+    """
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def entry_signature(entry):
+    """
+    Returns the file signature for an os.scandir entry.
+    """
+    stat = entry.stat()
+    if not stat.st_ino:
+        # On Windows DirEntry.stat() leaves st_ino and st_dev as 0.
+        stat = os.stat(entry.path)
+    return file_signature(stat)
+
+
+def lookup_fingerprint(con, signature, algorithm='md5'):
+    """
+    Returns the cached digest for a file signature, or None.
+    """
+    sql = 'SELECT digest FROM file_fingerprints ' \
+          'WHERE device=? AND inode=? AND size=? AND mtime_ns=? AND algorithm=?'
+    results = con.execute(sql, signature + (algorithm,)).fetchone()
+    return results[0] if results else None
+
+
+def store_fingerprint(cur, signature, digest, algorithm='md5'):
+    """
+    Remember the digest for a file signature.
+    """
+    sql = 'INSERT OR REPLACE INTO file_fingerprints ' \
+          '(device, inode, size, mtime_ns, algorithm, digest) VALUES (?, ?, ?, ?, ?, ?)'
+    cur.execute(sql, signature + (algorithm, digest))
+
+
+class Throughput():
+    """
+    Keeps track of how many bytes were hashed and how long it took, so the
+    hashing rate can be compared to the disk speed.
+    """
+    def __init__(self):
+        """
+        Start with nothing hashed.
+        """
+        self.start = time.perf_counter()
+        self.cached = 0
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.throttled = 0.0
+
+    def add(self, size, seconds, throttled=0.0):
+        """
+        Add one hashed file of size bytes that took seconds to hash,
+        throttled of which were spent waiting on the rate limit.
+        """
+        self.files += 1
+        self.bytes += size
+        self.seconds += seconds
+        self.throttled += throttled
+
+    def report(self):
+        """
+        Write the totals and the bytes/second rate to stderr. The rate uses
+        the elapsed time, so it includes all of the processes hashing.
+        """
+        elapsed = time.perf_counter() - self.start
+        rate = self.bytes / elapsed if elapsed else 0.0
+        sys.stderr.write(f'Hashed {self.files} files, {self.bytes / MEGABYTE:.1f} MB '
+                         f'in {elapsed:.1f} s ({rate / MEGABYTE:.1f} MB/s), '
+                         f'{self.seconds:.1f} s spent hashing, '
+                         f'{self.throttled:.1f} s throttled, '
+                         f'{self.cached} files from the fingerprint cache\n')
+
+
+def hash_file(path, block_size=MEGABYTE, mmap_threshold=256 * MEGABYTE, algorithm='md5',
+              rate_limiter=None):
+    """
+    Compute the digest of a file, MD5 by default, reading it in binary mode.
+    Files of at least mmap_threshold bytes are memory mapped, smaller ones
+    are read with readinto into a single reusable buffer of block_size bytes.
+    Each block is taken from rate_limiter, when given, before it is hashed.
+    Returns a (hex digest, bytes hashed) tuple.
+    """
+    file_hash = ALGORITHMS[algorithm]()
+    size = 0
+    with open(path, 'rb') as in_file:
+        fileno = in_file.fileno()
+        file_size = os.fstat(fileno).st_size
+        advise(fileno, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        if 0 < mmap_threshold <= file_size:
+            with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped, \
+                 memoryview(mapped) as view:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                for offset in range(0, file_size, block_size):
+                    if rate_limiter:
+                        rate_limiter.consume(min(block_size, file_size - offset))
+                    file_hash.update(view[offset:offset + block_size])
+                    advise(fileno, offset, block_size, 'POSIX_FADV_DONTNEED')
+            size = file_size
+        else:
+            buffer = bytearray(block_size)
+            view = memoryview(buffer)
+            while True:
+                count = in_file.readinto(buffer)
+                if not count:
+                    break
+                if rate_limiter:
+                    rate_limiter.consume(count)
+                file_hash.update(view[:count])
+                advise(fileno, size, count, 'POSIX_FADV_DONTNEED')
+                size += count
+    return (file_hash.hexdigest(), size)
+
+
+def advise(fileno, offset, length, advice):
+    """
+    Pass an access pattern hint, like POSIX_FADV_SEQUENTIAL, to the kernel.
+    Does nothing where posix_fadvise is not available, e.g. on Windows.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fileno, offset, length, getattr(os, advice))
 
 
 def db_open(db_file):
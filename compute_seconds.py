@@ -6,7 +6,10 @@ Run theough the clips table computing seconds from the duration field.
 import argparse
 import sqlite3
 import sys
-import re
+
+from bulk_timecode import backfill
+from schema import add_columns
+from timecode import register_functions
 
 
 def build_parser():
@@ -21,6 +24,12 @@ def build_parser():
                         help='File name of the SQlite database file. '
                         'default: %(default)s')
 
+    parser.add_argument('-c', '--chunk_size', type=int, default=0,
+                        help='Convert and commit this many clips at a time, reporting '
+                        'progress after each chunk. An interrupted run goes on from '
+                        'the last chunk committed. 0 does all of them in one UPDATE. '
+                        'default: %(default)s')
+
     return parser
 
 
@@ -29,64 +38,39 @@ def main(args):
     Main processing function.
     """
     con = db_open(args.database_file)
-    sql = 'SELECT id,duration FROM clips WHERE duration_seconds IS NULL'
-    cur = con.cursor()
-    cur.execute(sql)
-    pairs = []
-    while True:
-        results = cur.fetchone()
-        if not results:
-            break
-        pairs.append((results[0], to_seconds(results[1])))
-
-    sql = 'UPDATE clips SET duration_seconds = :seconds WHERE id = :id'
-    for (clip_id, seconds) in pairs:
-        con.execute(sql, {'id': clip_id, 'seconds': seconds})
-    con.commit()
-    print(len(pairs))
-
-
-def to_seconds(time_string):
-    """
-    Convert string time to seconds.
-    """
-    #                     s  s    f f
-    match = re.match(r'^(\d?\d):(\d\d)$', time_string)
-    if match:
-        hour = 0
-        minute = 0
-        sec = match.group(1)
-        frame = match.group(2)
+    add_columns(con, 'videos', [('fps', 'REAL')])
+    if args.chunk_size > 0:
+        updated = 0
+        bad = []
+        for (last_id, chunk_updated, chunk_bad) in backfill(con, 'duration_seconds', 'duration',
+                                                            args.chunk_size, seconds=True,
+                                                            duration=True):
+            updated += chunk_updated
+            bad += chunk_bad
+            sys.stderr.write(f'Up to clip id={last_id}: {updated} updated\n')
     else:
-        #                     m  m    s s    f f
-        match = re.match(r'^(\d?\d):(\d\d):(\d\d)$', time_string)
-        if match:
-            hour = 0
-            minute = match.group(1)
-            sec = match.group(2)
-            frame = match.group(3)
-        else:
-            #                     h  h    m m    s s    f f
-            match = re.match(r'^(\d?\d):(\d\d):(\d\d):(\d\d)$', time_string)
-            if match:
-                hour = match.group(1)
-                minute = match.group(2)
-                sec = match.group(3)
-                frame = match.group(4)
-            else:
-                print(f"Didn't match: {time_string}")
-                sys.exit(1)
-    if int(frame) >= 30:
-        print(f'Frame too large: {frame} in {time_string}')
+        # At the fps of the video, like backfill and the triggers of schema.py.
+        fps = '(SELECT fps FROM videos WHERE videos.id = clips.video_id)'
+        sql = f"""UPDATE clips SET duration_seconds = tc_duration_seconds(duration, {fps})
+WHERE duration_seconds IS NULL"""
+        updated = con.execute(sql).rowcount
+        con.commit()
+        # tc_duration_seconds is NULL for the ones that did not convert.
+        sql = 'SELECT id,duration FROM clips WHERE duration_seconds IS NULL'
+        bad = con.execute(sql).fetchall()
+        updated -= len(bad)
+    for (clip_id, duration) in bad:
+        print(f"Didn't match: {duration} clip id={clip_id}")
+    print(updated)
+    if bad:
         sys.exit(1)
-    return (int(hour) * 60 + int(minute)) * 60 + int(sec) + (int(frame) / 30.0)
 
 
 def db_open(db_file):
     """
     Open the database and return a connection object.
     """
-    return sqlite3.connect(db_file)
+    return register_functions(sqlite3.connect(db_file))
 
 
 if __name__ == '__main__':
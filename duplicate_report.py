@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Report the videos that have the same MD5 value, or the same digest for
+another algorithm used by compute_md5.py.
+
+Videos with a comment starting with dup are left out. The report can be
+written as text, JSON Lines (one duplicate group per line) or CSV (one
+video per line) so it can be fed to cleanup scripts.
+"""
+
+import argparse
+import csv
+from itertools import groupby
+import json
+import sqlite3
+import sys
+
+from schema import table_columns
+
+
+FORMATS = ['text', 'jsonl', 'csv']
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-d', '--database_file', default='example.db',
+                        help='File name of the SQlite database file. '
+                        'default: %(default)s')
+
+    parser.add_argument('-a', '--algorithm', default='md5',
+                        help='Compare the digests made with this algorithm. '
+                        'default: %(default)s')
+
+    parser.add_argument('-f', '--format', choices=FORMATS, default='text',
+                        help='Output format. '
+                        'default: %(default)s')
+
+    parser.add_argument('-o', '--output_file',
+                        help='Write the report here instead of stdout.')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    con = db_open(args.database_file)
+    if args.algorithm != 'md5' and 'digest' not in table_columns(con, 'videos'):
+        sys.exit(f'No {args.algorithm} digests in {args.database_file}, '
+                 f'run compute_md5.py --algorithm {args.algorithm} first.')
+    if args.output_file:
+        with open(args.output_file, 'w', newline='', encoding='utf-8') as out_file:
+            report_duplicates(con, out_file, args.format, args.algorithm)
+    else:
+        report_duplicates(con, sys.stdout, args.format, args.algorithm)
+
+
+def create_digest_indexes(con):
+    """
+    Create the indexes on videos.md5 and videos.digest if they are not there.
+    """
+    con.execute('CREATE INDEX IF NOT EXISTS videos_md5 ON videos (md5)')
+    if 'digest' in table_columns(con, 'videos'):
+        con.execute('CREATE INDEX IF NOT EXISTS videos_digest '
+                    'ON videos (digest_algorithm, digest)')
+    con.commit()
+
+
+def duplicate_groups(con, algorithm='md5'):
+    """
+    Yield (digest, [(id, comment, filename), ...]) for every digest shared
+    by more than one video, ordered by digest and then id. Only digests
+    made with algorithm are compared. This is a single query. There are
+    none before compute_md5.py has added the digest column.
+    """
+    create_digest_indexes(con)
+    if algorithm != 'md5' and 'digest' not in table_columns(con, 'videos'):
+        return
+    if algorithm == 'md5':
+        (column, same_algorithm) = ('md5', '')
+    else:
+        (column, same_algorithm) = ('digest', 'AND digest_algorithm = :algorithm')
+    sql = f"""SELECT {column}, id, comment, filename FROM (
+  SELECT {column}, id, comment, filename, count(*) OVER (PARTITION BY {column}) AS copies
+  FROM videos
+  WHERE {column} IS NOT NULL AND {column} != '' {same_algorithm}
+    AND comment NOT LIKE 'dup%')
+WHERE copies > 1
+ORDER BY {column}, id"""
+    cur = con.cursor()
+    cur.execute(sql, {'algorithm': algorithm})
+    for (digest, rows) in groupby(cur, key=lambda row: row[0]):
+        yield (digest, [row[1:] for row in rows])
+
+
+def report_duplicates(con, out_file, output_format='text', algorithm='md5'):
+    """
+    Write the duplicate groups to out_file in the given format.
+    """
+    writer = csv.writer(out_file) if output_format == 'csv' else None
+    if writer:
+        writer.writerow(['algorithm', 'digest', 'id', 'comment', 'filename'])
+    first_time = True
+    for (digest, videos) in duplicate_groups(con, algorithm):
+        if output_format == 'jsonl':
+            out_file.write(json.dumps({'algorithm': algorithm,
+                                       'digest': digest,
+                                       'videos': [{'id': video_id,
+                                                   'comment': comment,
+                                                   'filename': filename}
+                                                  for (video_id, comment, filename) in videos]})
+                           + '\n')
+        elif writer:
+            writer.writerows([algorithm, digest] + list(video) for video in videos)
+        else:
+            if first_time:
+                out_file.write(f'Duplicate {algorithm}\n')
+                first_time = False
+            for video in videos:
+                out_file.write('|'.join([str(field) for field in video]) + '\n')
+
+
+def db_open(db_file):
+    """
+    Open the database and return a connection object.
+    """
+    return sqlite3.connect(db_file)
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
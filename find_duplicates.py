@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Find duplicate videos without computing the MD5 of every file.
+
+Files are grouped by size first. Only files sharing a size have samples
+from their start, middle and end hashed, and only files whose samples
+still match are hashed in full. Most videos have a unique size, so only
+a small part of the catalog is ever read.
+"""
+
+import argparse
+from collections import defaultdict
+import hashlib
+import os
+from pathlib import Path
+import sqlite3
+import sys
+
+from compute_md5 import MEGABYTE, create_fingerprints, file_signature, hash_file, \
+    lookup_fingerprint, store_fingerprint
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-d', '--database_file', default='example.db',
+                        help='File name of the SQlite database file. '
+                        'default: %(default)s')
+
+    parser.add_argument('-v', '--videos_dir',
+                        default='F:/N/O/SPELLSNO/IMAGES/xxxbunker',
+                        help='Directory where videos are located. '
+                        'default: %(default)s')
+
+    parser.add_argument('-s', '--sample_size', type=int, default=64,
+                        help='Size in KB of each of the start, middle and end samples. '
+                        'default: %(default)s')
+
+    parser.add_argument('-b', '--block_size', type=int, default=1024,
+                        help='Size in KB of the buffer used to read whole files. '
+                        'default: %(default)s')
+
+    parser.add_argument('-m', '--mmap_threshold', type=int, default=256,
+                        help='Files of at least this many MB are memory mapped '
+                        'instead of read. 0 turns this off. '
+                        'default: %(default)s')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    con = db_open(args.database_file)
+    create_fingerprints(con)
+    sql = "SELECT id,filename,comment FROM videos WHERE comment NOT LIKE 'dup%' ORDER BY id"
+    cur = con.cursor()
+    cur.execute(sql)
+    videos = []
+    for (video_id, filename, comment) in cur.fetchall():
+        path = str(Path(args.videos_dir) / filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        videos.append((video_id, filename, comment, path, stat))
+
+    finder = DuplicateFinder(con, args.sample_size * 1024, args.block_size * 1024,
+                             args.mmap_threshold * MEGABYTE)
+    groups = finder.find(videos)
+    con.commit()
+    first_time = True
+    for group in groups:
+        if first_time:
+            print('Duplicate md5')
+            first_time = False
+        for (video_id, filename, comment) in group:
+            print('|'.join([str(field) for field in [video_id, comment, filename]]))
+    finder.report(sum(video[4].st_size for video in videos))
+
+
+class DuplicateFinder():
+    """
+    Narrows the videos down to the duplicates in three steps: same size,
+    same start/middle/end samples, same MD5.
+    """
+    def __init__(self, con, sample_size, block_size, mmap_threshold):
+        """
+        The connection is used for the fingerprint cache.
+        """
+        self.con = con
+        self.sample_size = sample_size
+        self.block_size = block_size
+        self.mmap_threshold = mmap_threshold
+        self.bytes_read = 0
+        self.sampled = 0
+        self.hashed = 0
+
+    def find(self, videos):
+        """
+        videos is a list of (id, filename, comment, path, stat) tuples.
+        Returns a list of groups of (id, filename, comment) that have the same
+        content, ordered by their lowest id.
+        """
+        by_size = defaultdict(list)
+        for video in videos:
+            by_size[video[4].st_size].append(video)
+
+        by_sample = defaultdict(list)
+        for (size, same_size) in by_size.items():
+            if len(same_size) < 2:
+                continue
+            for video in same_size:
+                by_sample[(size, self.sample_digest(video[3], size))].append(video)
+
+        groups = []
+        for ((size, sample), same_sample) in by_sample.items():
+            if len(same_sample) < 2:
+                continue
+            if size <= 3 * self.sample_size:
+                # The samples covered the whole file.
+                groups.append(same_sample)
+                continue
+            by_md5 = defaultdict(list)
+            for video in same_sample:
+                by_md5[self.md5(video[3], video[4])].append(video)
+            groups.extend(group for group in by_md5.values() if len(group) > 1)
+
+        return sorted([[(video_id, filename, comment)
+                        for (video_id, filename, comment, _, _) in sorted(group)]
+                       for group in groups])
+
+    def sample_digest(self, path, size):
+        """
+        Hash sample_size bytes from the start, middle and end of a file.
+        A file no bigger than the three samples is hashed whole.
+        """
+        self.sampled += 1
+        sample_hash = hashlib.md5()
+        with open(path, 'rb') as in_file:
+            if size <= 3 * self.sample_size:
+                offsets = [0]
+                length = size
+            else:
+                offsets = [0, (size - self.sample_size) // 2, size - self.sample_size]
+                length = self.sample_size
+            for offset in offsets:
+                in_file.seek(offset)
+                data = in_file.read(length)
+                self.bytes_read += len(data)
+                sample_hash.update(data)
+        return sample_hash.hexdigest()
+
+    def md5(self, path, stat):
+        """
+        The MD5 of a whole file, taken from the fingerprint cache when the
+        file has not changed since it was last hashed.
+        """
+        signature = file_signature(stat)
+        md5 = lookup_fingerprint(self.con, signature)
+        if not md5:
+            (md5, size) = hash_file(path, self.block_size, self.mmap_threshold)
+            self.hashed += 1
+            self.bytes_read += size
+            store_fingerprint(self.con.cursor(), signature, md5)
+        return md5
+
+    def report(self, total_bytes):
+        """
+        Write how much of the catalog had to be read to stderr.
+        """
+        percent = 100.0 * self.bytes_read / total_bytes if total_bytes else 0.0
+        sys.stderr.write(f'Sampled {self.sampled} files, hashed {self.hashed} in full, '
+                         f'read {self.bytes_read / MEGABYTE:.1f} of '
+                         f'{total_bytes / MEGABYTE:.1f} MB ({percent:.2f}%)\n')
+
+
+def db_open(db_file):
+    """
+    Open the database and return a connection object.
+    """
+    return sqlite3.connect(db_file)
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
@@ -0,0 +1,129 @@
+"""
+Histograms of durations with buckets of exponentially growing size, for
+percentiles computed in one pass in bounded memory.
+
+A value x > 0 goes in bucket ceil(log(x) / log(gamma)), with
+gamma = (1 + e) / (1 - e), so the middle of its bucket is within the
+relative error e of x whatever x is. This is the bucketing of DDSketch.
+The number of buckets grows with the log of the range of the values,
+not with their number. Values <= 0 are counted on their own.
+
+Fixed bins, given by their edges, are counted exactly next to the
+buckets, since a value on an edge would not always land in the right bin
+if they were counted from the buckets.
+
+Histograms with the same relative error and edges are merged by adding
+their counts, so parts of a table, or separate databases, can be done apart
+and combined. to_dict and from_dict convert them to and from dicts that
+json can store.
+"""
+
+import math
+
+import numpy as np
+
+
+class LogHistogram():
+    """
+    Counts of durations in log sized buckets, and in the bins between
+    edges.
+    """
+    def __init__(self, relative_error=0.01, edges=()):
+        """
+        Start empty. Percentiles come out within relative_error. The bins
+        are below edges[0], between each pair of edges and from edges[-1]
+        up, len(edges) + 1 of them.
+        """
+        self.relative_error = relative_error
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = math.log(self.gamma)
+        # Bucket index: count
+        self.counts = {}
+        self.zero_count = 0
+        self.edges = [float(edge) for edge in edges]
+        self.bin_counts = [0] * (len(self.edges) + 1)
+
+    @property
+    def count(self):
+        """
+        The number of values added.
+        """
+        return self.zero_count + sum(self.counts.values())
+
+    def add(self, values):
+        """
+        Add a sequence of values. None and NaN are left out.
+        """
+        values = np.array(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        # A value on an edge goes in the bin above it, like np.histogram.
+        bins = np.searchsorted(self.edges, values, side='right')
+        self.bin_counts = (np.array(self.bin_counts) +
+                           np.bincount(bins, minlength=len(self.bin_counts))).tolist()
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        indexes = np.ceil(np.log(positive) / self.log_gamma).astype(np.int64)
+        for (index, count) in zip(*[array.tolist() for array in
+                                    np.unique(indexes, return_counts=True)]):
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        """
+        Add the counts of other, which must have the same relative error
+        and edges.
+        """
+        if other.relative_error != self.relative_error:
+            raise ValueError(f'Cannot merge relative errors {self.relative_error} '
+                             f'and {other.relative_error}')
+        if other.edges != self.edges:
+            raise ValueError(f'Cannot merge bins {self.edges} and {other.edges}')
+        self.zero_count += other.zero_count
+        self.bin_counts = [count + other_count for (count, other_count) in
+                           zip(self.bin_counts, other.bin_counts)]
+        for (index, count) in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def value(self, index):
+        """
+        The value standing for the bucket with the given index.
+        """
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, fraction):
+        """
+        Returns the value below which the given fraction of the values are,
+        or None when there are none.
+        """
+        count = self.count
+        if not count:
+            return None
+        rank = fraction * (count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if rank < seen:
+                return self.value(index)
+        return self.value(max(self.counts))
+
+    def to_dict(self):
+        """
+        Returns the histogram as a dict that json can store.
+        """
+        return {'relative_error': self.relative_error,
+                'edges': self.edges,
+                'bin_counts': self.bin_counts,
+                'zero_count': self.zero_count,
+                'counts': {str(index): count for (index, count) in sorted(self.counts.items())}}
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Make a histogram from what to_dict returned.
+        """
+        histogram = cls(values['relative_error'], values['edges'])
+        histogram.bin_counts = list(values['bin_counts'])
+        histogram.zero_count = values['zero_count']
+        histogram.counts = {int(index): count for (index, count) in values['counts'].items()}
+        return histogram
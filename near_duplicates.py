@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+Find videos that look the same even though their bytes differ, like
+re-encodes and re-uploads of the same footage.
+
+A few frames of each video are decoded by ffmpeg as small gray images and
+turned into 64 bit perceptual hashes (pHash), which are kept in the
+video_hashes table so each video is only decoded once. Hashes within
+--distance bits of each other are found with a BK-tree, so the whole
+catalog is compared without checking every pair of videos.
+"""
+
+import argparse
+from collections import defaultdict
+from pathlib import Path
+import sqlite3
+import subprocess
+import sys
+
+import numpy as np
+
+
+# Size of the gray images the hashes are computed from.
+IMAGE_SIZE = 32
+# The hash comes from the HASH_SIZE x HASH_SIZE lowest frequencies.
+HASH_SIZE = 8
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-d', '--database_file', default='example.db',
+                        help='File name of the SQlite database file. '
+                        'default: %(default)s')
+
+    parser.add_argument('-v', '--videos_dir',
+                        default='F:/N/O/SPELLSNO/IMAGES/xxxbunker',
+                        help='Directory where videos are located. '
+                        'default: %(default)s')
+
+    parser.add_argument('--ffmpeg_dir', default='C:/Program Files/ImageMagick-7.1.1-Q16-HDRI',
+                        help='Directory holding ffmpeg and ffprobe. '
+                        'default: %(default)s')
+
+    parser.add_argument('-f', '--frames', type=int, default=5,
+                        help='Number of frames hashed per video. '
+                        'default: %(default)s')
+
+    parser.add_argument('-t', '--distance', type=int, default=6,
+                        help='Hashes differing in at most this many bits match. '
+                        'default: %(default)s')
+
+    parser.add_argument('-n', '--min_matches', type=int, default=3,
+                        help='Number of frames that have to match for two videos '
+                        'to be reported. '
+                        'default: %(default)s')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    con = db_open(args.database_file)
+    con.execute("""CREATE TABLE IF NOT EXISTS video_hashes (
+    video_id INTEGER,
+    frame INTEGER,
+    phash INTEGER,
+    PRIMARY KEY (video_id, frame),
+    FOREIGN KEY (video_id) REFERENCES videos (id))""")
+    ffmpeg = str(Path(args.ffmpeg_dir) / 'ffmpeg')
+    ffprobe = str(Path(args.ffmpeg_dir) / 'ffprobe')
+
+    sql = """SELECT id, filename FROM videos
+WHERE id NOT IN (SELECT video_id FROM video_hashes) ORDER BY id"""
+    cur = con.cursor()
+    cur.execute(sql)
+    sql = 'INSERT INTO video_hashes (video_id, frame, phash) VALUES (?, ?, ?)'
+    for (count, (video_id, filename)) in enumerate(cur.fetchall(), 1):
+        if count % 10 == 0:
+            sys.stderr.write('.')
+            sys.stderr.flush()
+        path = Path(args.videos_dir) / filename
+        if not path.is_file():
+            continue
+        images = sample_frames(str(path), args.frames, ffmpeg, ffprobe)
+        if not len(images):
+            print(f'No frames decoded: {filename}')
+            continue
+        con.executemany(sql, [(video_id, frame, to_signed(phash))
+                              for (frame, phash) in enumerate(phashes(images))])
+        con.commit()
+    sys.stderr.write('\n')
+
+    filenames = dict(con.execute('SELECT id, filename FROM videos'))
+    first_time = True
+    for (video_id, other_id, matches) in similar_videos(con, args.distance, args.min_matches):
+        if first_time:
+            print('Similar videos')
+            first_time = False
+        print('|'.join([str(video_id), str(other_id), str(matches),
+                        filenames[video_id], filenames[other_id]]))
+
+
+def sample_frames(filename, frames, ffmpeg, ffprobe):
+    """
+    Decode the given number of evenly spaced frames of a video, scaled down to
+    IMAGE_SIZE x IMAGE_SIZE gray images.
+    Returns a (frames, IMAGE_SIZE, IMAGE_SIZE) uint8 array.
+    """
+    result = subprocess.run([ffprobe, '-v', 'error', '-show_entries', 'format=duration',
+                             '-of', 'csv=p=0', filename],
+                            capture_output=True, text=True, check=False)
+    try:
+        duration = float(result.stdout.strip())
+    except ValueError:
+        return np.empty((0, IMAGE_SIZE, IMAGE_SIZE), dtype=np.uint8)
+    image_bytes = IMAGE_SIZE * IMAGE_SIZE
+    images = []
+    for frame in range(frames):
+        # Middle of each of the equal parts of the video.
+        seconds = duration * (frame + 0.5) / frames
+        result = subprocess.run([ffmpeg, '-v', 'error', '-ss', f'{seconds:.3f}', '-i', filename,
+                                 '-frames:v', '1',
+                                 '-vf', f'scale={IMAGE_SIZE}:{IMAGE_SIZE}:flags=area,format=gray',
+                                 '-f', 'rawvideo', '-'],
+                                capture_output=True, check=False)
+        if len(result.stdout) >= image_bytes:
+            images.append(np.frombuffer(result.stdout[:image_bytes], dtype=np.uint8))
+    return np.array(images, dtype=np.uint8).reshape(-1, IMAGE_SIZE, IMAGE_SIZE)
+
+
+def dct_matrix(size):
+    """
+    Returns the size x size orthonormal DCT-II matrix.
+    """
+    k = np.arange(size)[:, np.newaxis]
+    n = np.arange(size)[np.newaxis, :]
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+DCT = dct_matrix(IMAGE_SIZE)
+
+
+def phashes(images):
+    """
+    Compute the perceptual hash of each image in a (count, IMAGE_SIZE,
+    IMAGE_SIZE) array: the bits tell which of the lowest frequencies of
+    the 2D DCT are above their median, leaving out the average.
+    Returns a list of ints.
+    """
+    coefficients = DCT @ images.astype(np.float64) @ DCT.T
+    low = coefficients[:, :HASH_SIZE, :HASH_SIZE].reshape(len(images), -1)
+    medians = np.median(low[:, 1:], axis=1)[:, np.newaxis]
+    bits = np.packbits(low > medians, axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in bits]
+
+
+def to_signed(value):
+    """
+    SQlite integers are signed 64 bit values.
+    """
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    """
+    Undo to_signed.
+    """
+    return value + (1 << 64) if value < 0 else value
+
+
+class BKTree():
+    """
+    Burkhard-Keller tree of 64 bit hashes using the Hamming distance, for
+    finding all hashes near a given one without comparing against each.
+    """
+    def __init__(self):
+        """
+        Start with an empty tree. A node is [hash, items, {distance: child}].
+        """
+        self.root = None
+
+    def add(self, value, item):
+        """
+        Add item under value.
+        """
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = (value ^ node[0]).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            if distance not in node[2]:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = node[2][distance]
+
+    def search(self, value, radius):
+        """
+        Yield the items of every hash within radius bits of value.
+        """
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node = nodes.pop()
+            distance = (value ^ node[0]).bit_count()
+            if distance <= radius:
+                yield from node[1]
+            for (child_distance, child) in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    nodes.append(child)
+
+
+def similar_videos(con, distance, min_matches):
+    """
+    Yield (video_id, other_id, matches) for every pair of videos with at
+    least min_matches frames within distance bits of a frame of the other,
+    ordered by video_id and other_id.
+    """
+    tree = BKTree()
+    frames = defaultdict(list)
+    for (video_id, phash) in con.execute('SELECT video_id, phash FROM video_hashes '
+                                         'ORDER BY video_id, frame'):
+        phash = to_unsigned(phash)
+        tree.add(phash, video_id)
+        frames[video_id].append(phash)
+    for (video_id, hashes) in sorted(frames.items()):
+        matches = defaultdict(int)
+        for phash in hashes:
+            for other_id in set(tree.search(phash, distance)):
+                if other_id > video_id:
+                    matches[other_id] += 1
+        for (other_id, count) in sorted(matches.items()):
+            if count >= min_matches:
+                yield (video_id, other_id, count)
+
+
+def db_open(db_file):
+    """
+    Open the database and return a connection object.
+    """
+    return sqlite3.connect(db_file)
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
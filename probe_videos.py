@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Fill in videos.fps, the frame rate of each video, and videos.length_frames,
+its length in frames, using ffprobe.
+
+The clip times are read off the video in the video editor, so they count
+frames at the rate of the video. With the fps known, timecode.py converts
+them to the right frame offsets, using drop-frame timecode for 29.97 and
+59.94 fps videos. When the triggers from schema.py are installed, the
+frames of the clips of a video are recomputed when its fps changes.
+validate_clips.py uses the length to find clips running past the end.
+"""
+
+import argparse
+from fractions import Fraction
+from pathlib import Path
+import sqlite3
+import subprocess
+import sys
+
+from schema import add_columns
+from timecode import register_functions
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-d', '--database_file', default='example.db',
+                        help='File name of the SQlite database file. '
+                        'default: %(default)s')
+
+    parser.add_argument('-v', '--videos_dir',
+                        default='F:/N/O/SPELLSNO/IMAGES/xxxbunker',
+                        help='Directory where videos are located. '
+                        'default: %(default)s')
+
+    parser.add_argument('--ffmpeg_dir', default='C:/Program Files/ImageMagick-7.1.1-Q16-HDRI',
+                        help='Directory holding ffprobe. '
+                        'default: %(default)s')
+
+    parser.add_argument('-a', '--all', action='store_true',
+                        help='Probe every video, not just the ones without an fps '
+                        'or length.')
+
+    parser.add_argument('--batch_size', type=int, default=20,
+                        help='Number of results written per transaction. '
+                        'default: %(default)s')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    con = db_open(args.database_file)
+    add_columns(con, 'videos', [('fps', 'REAL'), ('length_frames', 'INTEGER')])
+    ffprobe = str(Path(args.ffmpeg_dir) / 'ffprobe')
+    where = '' if args.all else 'WHERE fps IS NULL OR length_frames IS NULL'
+    videos = con.execute(f'SELECT id, filename FROM videos {where} ORDER BY id').fetchall()
+    sql = 'UPDATE videos SET fps = :fps, length_frames = :length_frames WHERE id = :id'
+    probed = 0
+    for (count, (video_id, filename)) in enumerate(videos, 1):
+        path = Path(args.videos_dir) / filename
+        if not path.is_file():
+            continue
+        (fps, length_frames) = probe(ffprobe, str(path))
+        if fps is None:
+            print(f'No frame rate: {filename}')
+            continue
+        con.execute(sql, {'id': video_id, 'fps': fps, 'length_frames': length_frames})
+        probed += 1
+        if count % args.batch_size == 0:
+            con.commit()
+            sys.stderr.write('.')
+            sys.stderr.flush()
+    con.commit()
+    sys.stderr.write('\n')
+    print(f'Probed {probed} of {len(videos)} videos')
+
+
+def probe(ffprobe, filename):
+    """
+    Returns (fps, length in frames) of the first video stream of the file.
+    Either is None when ffprobe cannot tell.
+    """
+    result = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                             '-show_entries', 'stream=r_frame_rate:format=duration',
+                             '-of', 'csv=p=0', filename],
+                            capture_output=True, text=True, check=False)
+    (fps, seconds) = (None, None)
+    for line in result.stdout.split():
+        try:
+            if '/' in line:
+                # Like 30000/1001.
+                fps = Fraction(line)
+            else:
+                seconds = float(line)
+        except (ValueError, ZeroDivisionError):
+            pass
+    if not fps or fps <= 0:
+        return (None, None)
+    if seconds is None:
+        return (float(fps), None)
+    # Allow for seconds * fps coming out just below a whole number.
+    return (float(fps), int(seconds * fps + 1e-6))
+
+
+def db_open(db_file):
+    """
+    Open the database and return a connection object.
+    """
+    return register_functions(sqlite3.connect(db_file))
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
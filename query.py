@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Run SQL against the database with the timecode functions registered, so
+ad-hoc queries can use them, for example:
+
+  ./query.py "SELECT id, start_time FROM clips WHERE tc_frames(start_time) IS NULL"
+
+tc_seconds(time) and tc_frames(time) convert a clip start time the same
+way the Python programs do, and are NULL when it does not convert.
+tc_duration_seconds(duration) and tc_duration_frames(duration) do the
+same for durations, which are not drop-frame timecode. The
+SQL is read from standard input when not given on the command line. Rows
+are printed with the columns separated by |.
+"""
+
+import argparse
+import sqlite3
+import sys
+
+from timecode import register_functions
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-d', '--database_file', default='example.db',
+                        help='File name of the SQlite database file. '
+                        'default: %(default)s')
+
+    parser.add_argument('sql', nargs='?',
+                        help='SQL statements to run.')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    con = db_open(args.database_file)
+    sql = args.sql if args.sql is not None else sys.stdin.read()
+    cur = con.cursor()
+    for statement in split_statements(sql):
+        cur.execute(statement)
+        for row in cur:
+            print('|'.join('' if value is None else str(value) for value in row))
+    con.commit()
+
+
+def split_statements(sql):
+    """
+    Yield each statement in sql.
+    """
+    statement = ''
+    # A ; can also be inside a string, so only split where it ends a statement.
+    for part in sql.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \t\n;'):
+                yield statement
+            statement = ''
+    if statement.strip(' \t\n;'):
+        yield statement
+
+
+def db_open(db_file):
+    """
+    Open the database and return a connection object.
+    """
+    return register_functions(sqlite3.connect(db_file))
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
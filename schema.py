@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Helpers used by the other programs to bring an existing database up to
+date with the columns and tables they need.
+
+Run as a program, this installs the triggers that keep the start_frame
+and duration_frames columns of the clips table in step with the
+start_time and duration strings whenever a clip is added or changed,
+whichever of the two was set, and duration_seconds with the duration.
+The conversions use the fps of the video, from videos.fps, and the
+frames of its clips are recomputed when that changes. It fills them in
+for the clips already there. The frames are what the programs here
+work with, the strings are what is displayed. There is an index on
+(video_id, start_frame), for finding the clips at a given time in a
+video. The triggers call the tc_seconds, tc_frames and tc_string
+functions from timecode.py, and their tc_duration_ versions, so every program that adds or changes
+clips or videos.fps has to register them on its connection.
+
+It also adds the clip_stats table, holding the count, total, sum of
+squares, minimum and maximum of duration_seconds for each activity,
+which more triggers keep up to date as clips change, so stats.py can
+read it instead of the whole clips table. --rebuild_stats computes it
+again from the clips table.
+"""
+
+import argparse
+import sqlite3
+
+from timecode import register_functions
+
+
+# The fps of the video of the clip.
+VIDEO_FPS = '(SELECT fps FROM videos WHERE id = NEW.video_id)'
+# Sets the time strings and the frames of a clip from each other, and
+# duration_seconds from the duration. {start_wins} and {duration_wins}
+# tell when the frames were given and the string has to follow them.
+SYNC = """UPDATE clips SET
+        start_time = CASE WHEN {start_wins}
+                               AND NEW.start_frame IS NOT tc_frames(NEW.start_time, {fps})
+                          THEN tc_string(NEW.start_frame, {fps}) ELSE start_time END,
+        start_frame = CASE WHEN {start_wins} THEN start_frame
+                           ELSE tc_frames(start_time, {fps}) END,
+        duration = CASE WHEN {duration_wins}
+                             AND NEW.duration_frames IS NOT tc_duration_frames(NEW.duration, {fps})
+                        THEN tc_duration_string(NEW.duration_frames, {fps}) ELSE duration END,
+        duration_frames = CASE WHEN {duration_wins} THEN duration_frames
+                               ELSE tc_duration_frames(duration, {fps}) END,
+        duration_seconds = tc_duration_seconds(
+            CASE WHEN {duration_wins} THEN tc_duration_string(NEW.duration_frames, {fps})
+                 ELSE duration END, {fps})
+    WHERE id = NEW.id;"""
+# Only fire when something is out of step. The UPDATE in the trigger
+# leaves everything in step, so this also stops it from firing itself
+# when recursive_triggers is on.
+OUT_OF_STEP = """NEW.start_frame IS NOT tc_frames(NEW.start_time, {fps})
+   OR NEW.duration_frames IS NOT tc_duration_frames(NEW.duration, {fps})
+   OR NEW.duration_seconds IS NOT tc_duration_seconds(NEW.duration, {fps})"""
+
+# Name and SQL of the triggers that keep the clips columns in step.
+TRIGGERS = {
+    # Frames given with the insert win over the strings.
+    'clips_times_insert': f"""CREATE TRIGGER clips_times_insert
+AFTER INSERT ON clips
+WHEN {OUT_OF_STEP.format(fps=VIDEO_FPS)}
+BEGIN
+    {SYNC.format(start_wins='NEW.start_frame IS NOT NULL',
+                 duration_wins='NEW.duration_frames IS NOT NULL', fps=VIDEO_FPS)}
+END""",
+    # Whichever of the string and the frames was changed wins.
+    'clips_times_update': f"""CREATE TRIGGER clips_times_update
+AFTER UPDATE OF start_time, duration, start_frame, duration_frames ON clips
+WHEN {OUT_OF_STEP.format(fps=VIDEO_FPS)}
+BEGIN
+    {SYNC.format(start_wins='NEW.start_frame IS NOT OLD.start_frame '
+                 'AND NEW.start_frame IS NOT NULL',
+                 duration_wins='NEW.duration_frames IS NOT OLD.duration_frames '
+                 'AND NEW.duration_frames IS NOT NULL', fps=VIDEO_FPS)}
+END""",
+    # The time strings were read off the video, so they stay and the
+    # frames follow the new fps.
+    'videos_fps_update': """CREATE TRIGGER videos_fps_update
+AFTER UPDATE OF fps ON videos
+WHEN OLD.fps IS NOT NEW.fps
+BEGIN
+    UPDATE clips SET start_frame = tc_frames(start_time, NEW.fps),
+                     duration_frames = tc_duration_frames(duration, NEW.fps),
+                     duration_seconds = tc_duration_seconds(duration, NEW.fps)
+    WHERE video_id = NEW.id;
+END""",
+}
+
+
+# Add the duration of the NEW clip to the clip_stats row of its activity,
+# adding the row if needed.
+ADD_DURATION = """INSERT INTO clip_stats (activity) SELECT NEW.activity
+    WHERE NOT EXISTS (SELECT 1 FROM clip_stats WHERE activity IS NEW.activity);
+    UPDATE clip_stats SET count = count + 1,
+        total = total + NEW.duration_seconds,
+        sum_squares = sum_squares + NEW.duration_seconds * NEW.duration_seconds,
+        minimum = min(coalesce(minimum, NEW.duration_seconds), NEW.duration_seconds),
+        maximum = max(coalesce(maximum, NEW.duration_seconds), NEW.duration_seconds)
+    WHERE activity IS NEW.activity AND NEW.duration_seconds IS NOT NULL;"""
+# Take the duration of the OLD clip out. When it was the minimum or the
+# maximum, the new one is found with the clips_activity_duration index.
+# Taking out the last one sets the sums to 0, not to what rounding left.
+REMOVE_DURATION = """UPDATE clip_stats SET count = count - 1,
+        total = CASE WHEN count = 1 THEN 0 ELSE total - OLD.duration_seconds END,
+        sum_squares = CASE WHEN count = 1 THEN 0
+                           ELSE sum_squares - OLD.duration_seconds * OLD.duration_seconds END,
+        minimum = CASE WHEN OLD.duration_seconds > minimum THEN minimum
+                       ELSE (SELECT min(duration_seconds) FROM clips
+                             WHERE activity IS OLD.activity) END,
+        maximum = CASE WHEN OLD.duration_seconds < maximum THEN maximum
+                       ELSE (SELECT max(duration_seconds) FROM clips
+                             WHERE activity IS OLD.activity) END
+    WHERE activity IS OLD.activity AND OLD.duration_seconds IS NOT NULL;"""
+
+# Name and SQL of the triggers that keep clip_stats up to date.
+STATS_TRIGGERS = {
+    'clip_stats_insert': f"""CREATE TRIGGER clip_stats_insert
+AFTER INSERT ON clips
+BEGIN
+    {ADD_DURATION}
+END""",
+    'clip_stats_delete': f"""CREATE TRIGGER clip_stats_delete
+AFTER DELETE ON clips
+BEGIN
+    {REMOVE_DURATION}
+END""",
+    'clip_stats_update': f"""CREATE TRIGGER clip_stats_update
+AFTER UPDATE OF activity, duration_seconds ON clips
+WHEN OLD.activity IS NOT NEW.activity OR OLD.duration_seconds IS NOT NEW.duration_seconds
+BEGIN
+    {REMOVE_DURATION}
+    {ADD_DURATION}
+END""",
+}
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-d', '--database_file', default='example.db',
+                        help='File name of the SQlite database file. '
+                        'default: %(default)s')
+
+    parser.add_argument('--remove', action='store_true',
+                        help='Remove the triggers instead, for instance before '
+                        'editing clips with a tool that does not have the functions.')
+
+    parser.add_argument('--rebuild_stats', action='store_true',
+                        help='Only compute the clip_stats table again from the clips table.')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    con = db_open(args.database_file)
+    if args.remove:
+        remove_triggers(con)
+        print('Removed triggers')
+    elif args.rebuild_stats:
+        rebuild_clip_stats(con)
+        print('Rebuilt clip_stats')
+    else:
+        updated = install_triggers(con)
+        print(f'Installed triggers, updated {updated} clips')
+
+
+def table_columns(con, table):
+    """
+    Returns the set of column names in table.
+    """
+    return {row[1] for row in con.execute(f'PRAGMA table_info({table})')}
+
+
+def add_columns(con, table, columns):
+    """
+    Add each (name, declaration) column to table unless it is already there.
+    """
+    existing = table_columns(con, table)
+    for (name, declaration) in columns:
+        if name not in existing:
+            con.execute(f'ALTER TABLE {table} ADD COLUMN {name} {declaration}')
+    con.commit()
+
+
+def has_triggers(con, triggers=TRIGGERS):
+    """
+    True if the triggers are installed, by default the ones computing the
+    clips columns.
+    """
+    sql = "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+    return set(triggers) <= {row[0] for row in con.execute(sql)}
+
+
+def install_triggers(con):
+    """
+    Add the clips.duration_frames and videos.fps columns, the indexes and
+    the clip_stats table, install the triggers, replacing older versions
+    of them, and bring the computed columns of every clip and clip_stats
+    up to date. con must have the timecode functions registered.
+    Returns the number of clips updated.
+    """
+    add_columns(con, 'clips', [('duration_frames', 'INTEGER')])
+    add_columns(con, 'videos', [('fps', 'REAL')])
+    con.execute('CREATE INDEX IF NOT EXISTS clips_video_start ON clips (video_id, start_frame)')
+    remove_triggers(con)
+    for sql in TRIGGERS.values():
+        con.execute(sql)
+    # Recompute the ones that are wrong too, not only the NULL ones.
+    fps = '(SELECT fps FROM videos WHERE videos.id = clips.video_id)'
+    sql = f"""UPDATE clips SET start_frame = tc_frames(start_time, {fps}),
+                 duration_frames = tc_duration_frames(duration, {fps}),
+                 duration_seconds = tc_duration_seconds(duration, {fps})
+WHERE start_frame IS NOT tc_frames(start_time, {fps})
+   OR duration_frames IS NOT tc_duration_frames(duration, {fps})
+   OR duration_seconds IS NOT tc_duration_seconds(duration, {fps})"""
+    updated = con.execute(sql).rowcount
+    con.commit()
+
+    con.execute("""CREATE TABLE IF NOT EXISTS clip_stats (
+    activity TEXT,
+    count INTEGER DEFAULT 0,
+    total REAL DEFAULT 0,
+    sum_squares REAL DEFAULT 0,
+    minimum REAL,
+    maximum REAL)""")
+    con.execute('CREATE INDEX IF NOT EXISTS clips_activity_duration '
+                'ON clips (activity, duration_seconds)')
+    for sql in STATS_TRIGGERS.values():
+        con.execute(sql)
+    rebuild_clip_stats(con)
+    return updated
+
+
+def rebuild_clip_stats(con):
+    """
+    Compute clip_stats from the clips table, to repair any drift.
+    """
+    con.execute('DELETE FROM clip_stats')
+    con.execute("""INSERT INTO clip_stats
+SELECT activity, count(duration_seconds), coalesce(sum(duration_seconds), 0),
+  coalesce(sum(duration_seconds * duration_seconds), 0),
+  min(duration_seconds), max(duration_seconds)
+FROM clips GROUP BY activity""")
+    con.commit()
+
+
+def remove_triggers(con):
+    """
+    Remove the triggers.
+    """
+    for name in list(TRIGGERS) + list(STATS_TRIGGERS):
+        con.execute(f'DROP TRIGGER IF EXISTS {name}')
+    con.commit()
+
+
+def db_open(db_file):
+    """
+    Open the database and return a connection object.
+    """
+    return register_functions(sqlite3.connect(db_file))
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Re-read videos and compare them to their stored MD5 values, to find bit rot
+and truncated copies.
+
+Each run checks a slice of the videos, the ones verified longest ago first,
+so that running this once a day checks every video within --period_days.
+The time of each check goes in videos.verified_date. When the file no longer
+matches, the new digest (or 'missing') goes in videos.verify_mismatch. An
+interrupted run picks up where it stopped.
+"""
+
+import argparse
+from datetime import datetime
+import math
+import os
+from pathlib import Path
+import sqlite3
+import sys
+
+from compute_md5 import ALGORITHMS, MEGABYTE, Throughput, hash_video, init_limiter
+from schema import add_columns, table_columns
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-d', '--database_file', default='example.db',
+                        help='File name of the SQlite database file. '
+                        'default: %(default)s')
+
+    parser.add_argument('-v', '--videos_dir',
+                        default='F:/N/O/SPELLSNO/IMAGES/xxxbunker',
+                        help='Directory where videos are located. '
+                        'default: %(default)s')
+
+    parser.add_argument('-a', '--algorithm', choices=sorted(ALGORITHMS), default='md5',
+                        help='Check the digests made with this algorithm. '
+                        'default: %(default)s')
+
+    parser.add_argument('-p', '--period_days', type=int, default=30,
+                        help='Check 1/period_days of the videos, so a daily run '
+                        'gets through all of them in this many days. '
+                        'default: %(default)s')
+
+    parser.add_argument('-l', '--limit', type=int,
+                        help='Check this many videos instead.')
+
+    parser.add_argument('-b', '--block_size', type=int, default=1024,
+                        help='Size in KB of the buffer used to read each file. '
+                        'default: %(default)s')
+
+    parser.add_argument('-m', '--mmap_threshold', type=int, default=256,
+                        help='Files of at least this many MB are memory mapped '
+                        'instead of read. 0 turns this off. '
+                        'default: %(default)s')
+
+    parser.add_argument('--max_mb_per_sec', type=float, default=0,
+                        help='Read at most this many MB per second. 0 means no limit. '
+                        'default: %(default)s')
+
+    parser.add_argument('--batch_size', type=int, default=20,
+                        help='Number of results written per transaction. '
+                        'default: %(default)s')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    con = db_open(args.database_file)
+    if args.algorithm != 'md5' and 'digest' not in table_columns(con, 'videos'):
+        sys.exit(f'No {args.algorithm} digests in {args.database_file}, '
+                 f'run compute_md5.py --algorithm {args.algorithm} first.')
+    add_columns(con, 'videos', [('verified_date', 'TEXT'), ('verify_mismatch', 'TEXT')])
+    if args.algorithm == 'md5':
+        (column, same_algorithm) = ('md5', '')
+    else:
+        (column, same_algorithm) = ('digest', 'AND digest_algorithm = :algorithm')
+    where = f"WHERE {column} IS NOT NULL AND {column} != '' {same_algorithm}"
+    cur = con.cursor()
+    cur.execute(f'SELECT count(*) FROM videos {where}', {'algorithm': args.algorithm})
+    total = cur.fetchone()[0]
+    limit = args.limit or math.ceil(total / max(args.period_days, 1))
+    # Never checked first, then oldest check first.
+    sql = f"""SELECT id, filename, {column} FROM videos {where}
+ORDER BY verified_date IS NOT NULL, verified_date, id LIMIT :limit"""
+    cur.execute(sql, {'algorithm': args.algorithm, 'limit': limit})
+    videos = cur.fetchall()
+    print(f'Checking {len(videos)} of {total} videos')
+
+    init_limiter(args.max_mb_per_sec * MEGABYTE)
+    throughput = Throughput()
+    sql = 'UPDATE videos SET verified_date = :verified_date, ' \
+          'verify_mismatch = :mismatch WHERE id = :id'
+    mismatches = 0
+    for (count, (video_id, filename, stored)) in enumerate(videos, 1):
+        path = str(Path(args.videos_dir) / filename)
+        if os.path.isfile(path):
+            task = (video_id, filename, path, None, args.algorithm,
+                    args.block_size * 1024, args.mmap_threshold * MEGABYTE)
+            (_, _, digest, _, size, seconds, throttled, error) = hash_video(task)
+            throughput.add(size, seconds, throttled)
+            if error:
+                digest = 'unreadable'
+        else:
+            digest = 'missing'
+        mismatch = None if digest == stored else digest
+        if mismatch:
+            mismatches += 1
+            print(f'{video_id}|{filename}: stored {stored}, now {mismatch}')
+        cur.execute(sql, {'id': video_id, 'mismatch': mismatch,
+                          'verified_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+        if count % args.batch_size == 0:
+            con.commit()
+    con.commit()
+    throughput.report()
+    print(f'Mismatches: {mismatches}')
+
+
+def db_open(db_file):
+    """
+    Open the database and return a connection object.
+    """
+    return sqlite3.connect(db_file)
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
@@ -2,13 +2,29 @@
 """
 Calculation various statistics on video clips.
 Also does a check on time values.
+
+Several databases, like the catalog split by year, are reported as one:
+the sums and histograms of each are computed on their own, in parallel
+with --jobs, and merged.
+
+The results for each database are kept in a cache file next to it, with
+the file change counter from the database header, which SQlite
+increments with every committed write, and the size and time of the
+database and its WAL file. While none of these change the results are
+taken from there without reading the database.
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
 import sqlite3
 import math
 import sys
-import re
+
+from histogram import LogHistogram
+from schema import STATS_TRIGGERS, add_columns, has_triggers
+from timecode import is_start_time, register_functions, to_frames, to_seconds
 
 activities = {
     'L': 'Lick',
@@ -18,6 +34,9 @@ activities = {
     'U': 'Up',
     }
 
+# Part of the key of the cache entries, changed when what they hold changes.
+CACHE_VERSION = 4
+
 
 def build_parser():
     """
@@ -27,10 +46,43 @@ def build_parser():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description=__doc__.strip())
 
-    parser.add_argument('-d', '--database_file', default='example.db',
-                        help='File name of the SQlite database file. '
+    parser.add_argument('-d', '--database_file', nargs='+', default=['example.db'],
+                        help='File names of the SQlite database files, reported '
+                        'together. '
+                        'default: %(default)s')
+
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes checking the time values, or with '
+                        'several databases reading them, at the same time. '
+                        'default: %(default)s')
+
+    parser.add_argument('--chunk_size', type=int, default=100000,
+                        help='Number of clips checked by a process at a time, and '
+                        'of durations read at a time for --percentiles. '
+                        'default: %(default)s')
+
+    parser.add_argument('-n', '--no_check', action='store_true',
+                        help='Do not check the time values of every clip. With the '
+                        'clip_stats table from schema.py the report then does not read '
+                        'the clips table at all.')
+
+    parser.add_argument('-p', '--percentiles', action='store_true',
+                        help='Also report the 50th, 90th and 99th percentile and a '
+                        'histogram of the durations of each activity. These are within '
+                        '1%% of the exact values.')
+
+    parser.add_argument('--bins', default='5,10,20,30,60,120',
+                        help='Comma separated edges in seconds of the histogram bins. '
                         'default: %(default)s')
 
+    parser.add_argument('--cache_file',
+                        help='File keeping the results of the last runs. '
+                        'default: each database file name followed by .stats.json')
+
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Compute the report from the database even if it has not '
+                        'changed, and do not keep it.')
+
     return parser
 
 
@@ -38,201 +90,472 @@ def main(args):
     """
     Main processing function.
     """
-    con = db_open(args.database_file)
-    #             0  1        2          3
-    sql = 'SELECT id,video_id,start_time,duration FROM clips'
-    cur = con.cursor()
-    cur.execute(sql)
-    bad_data = []
-    fatal_error_count = 0
-    while True:
-        results = cur.fetchone()
-        if not results:
-            break
-        if not check_start(results[2]):
-            bad_data.append((results[0], results[1], results[2]))
-        try:
-            check_seconds(results[3])
-        except Exception as arg:
-            (id, video_id, start_time, duration) = results
-            sql = 'SELECT filename FROM videos WHERE id=:video_id'
-            cur.execute(sql, {'video_id': video_id})
-            results = cur.fetchone()
-            print(arg,(id, video_id, start_time, duration), results[0])
-            fatal_error_count += 1
-    if fatal_error_count:
+    options = [CACHE_VERSION, args.no_check, args.percentiles, args.bins]
+    edges = [float(edge) for edge in args.bins.split(',')]
+    databases = args.database_file
+    cache_files = [None if args.no_cache else args.cache_file or database_file + '.stats.json'
+                   for database_file in databases]
+    entries = [read_cache(cache_file, cache_key(database_file, options))
+               for (database_file, cache_file) in zip(databases, cache_files)]
+    if len(databases) == 1 and entries[0]:
+        sys.stdout.write(entries[0]['report'])
+        return
+
+    # The databases not in the cache. With several of them each one is
+    # read by a process of its own, and checks its time values in it.
+    todo = [index for (index, entry) in enumerate(entries) if entry is None]
+    parallel = len(todo) > 1 and args.jobs > 1
+    tasks = [(databases[index], args.no_check, 1 if parallel else args.jobs, args.chunk_size,
+              args.percentiles, edges) for index in todo]
+    if parallel:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(database_results, tasks))
+    else:
+        results = list(map(database_results, tasks))
+    failed = False
+    for (index, entry) in zip(todo, results):
+        for line in entry['errors']:
+            print(line if len(databases) == 1 else f'{databases[index]}: {line}')
+        if entry['errors']:
+            failed = True
+            continue
+        entries[index] = entry
+        # After the writes of database_results, so the next run finds the
+        # database as it is now.
+        write_cache(cache_files[index], cache_key(databases[index], options), entry)
+    if failed:
         sys.exit(1)
+    if len(databases) == 1:
+        sys.stdout.write(entries[0]['report'])
+        return
+
+    # The sums and histograms of the activities merged over the databases.
+    lines = []
+    accumulators = {}
+    histograms = {}
+    for (database_file, entry) in zip(databases, entries):
+        lines += [f'{database_file}: {line}' for line in entry['messages']]
+        for (activity, values) in entry['accumulators']:
+            accumulators.setdefault(activity, Accumulator()).merge(Accumulator.from_list(values))
+        for (activity, values) in entry['histograms'] or []:
+            histograms.setdefault(activity, LogHistogram(edges=edges)).merge(
+                LogHistogram.from_dict(values))
+    # Sorted like ORDER BY activity, no activity first.
+    lines += report_lines(sorted(accumulators.items(),
+                                 key=lambda item: (item[0] is not None, item[0])))
+    if args.percentiles:
+        lines += distribution_lines(histograms, edges)
+    sys.stdout.write(''.join(f'{line}\n' for line in lines))
+
+
+def database_results(task):
+    """
+    Check, complete and sum up the clips of one database.
+    task is (database_file, no_check, jobs, chunk_size, percentiles, edges).
+    Returns a dict of the error lines, which stop the report, the other
+    messages, the report of this database alone, and the accumulators and
+    histograms of its activities as lists that json can store.
+    """
+    (database_file, no_check, jobs, chunk_size, percentiles, edges) = task
+    con = db_open(database_file)
+    add_columns(con, 'videos', [('fps', 'REAL')])
+    # The triggers installed by schema.py keep duration_seconds and
+    # start_frame up to date, and the sums of each activity in clip_stats.
+    stored_sums = has_triggers(con, STATS_TRIGGERS)
+    backfill = not has_triggers(con)
+    if no_check and stored_sums and not backfill and not percentiles:
+        results = empty_results()
+    else:
+        results = scan(con, (database_file, not no_check, backfill, not stored_sums,
+                             edges if percentiles else None), jobs, chunk_size)
+    (bad_data, errors) = (results['bad_data'], results['errors'])
+    # The filenames of the videos with problems, in one query.
+    video_ids = sorted({row[1] for row in bad_data} | {row[2] for row in errors})
+    sql = 'SELECT id, filename FROM videos WHERE id IN (SELECT value FROM json_each(?))'
+    filenames = dict(con.execute(sql, (json.dumps(video_ids),)))
+    error_lines = [' '.join(str(value) for value in
+                            (message, (clip_id, video_id, start_time, duration),
+                             filenames.get(video_id)))
+                   for (message, clip_id, video_id, start_time, duration) in errors]
+    if errors:
+        con.close()
+        return {'errors': error_lines}
+    messages = []
     if bad_data:
-        print('Bad data:')
-        cur = con.cursor()
-        sql = 'SELECT id,filename FROM videos WHERE id=:video_id'
+        messages.append('Bad data:')
         for (clip_id, video_id, start_time) in bad_data:
-            cur.execute(sql, {'video_id': video_id})
-            results = cur.fetchone()
-            print(clip_id, video_id, start_time, results[1])
-
-    # Make sure duration_seconds and start_frame have values.
-    sql = "SELECT id, start_time, duration FROM clips " \
-          "WHERE duration_seconds IS NULL OR start_frame IS NULL"
-    cur.execute(sql)
-    for results in cur.fetchall():
-        try:
-            (id, start_time, duration) = results
-            start_frame = to_start_frame(start_time)
-            duration_seconds = to_seconds(duration)
-            sql = 'UPDATE clips SET start_frame=:start_frame, ' \
-                  'duration_seconds=:duration_seconds WHERE id=:id'
-            cur.execute(sql, {'id': id, 'start_frame': start_frame,
-                              'duration_seconds': duration_seconds})
-        except Exception as exception:
-            print(f'{exception=}: clip id={id}')
-    con.commit()
+            messages.append(' '.join(str(value) for value in
+                                     (clip_id, video_id, start_time, filenames.get(video_id))))
+
+    # Store the duration_seconds and start_frame the scan worked out.
+    for (clip_id, start_time, duration) in results['bad_fills']:
+        messages.append(f'Bad {start_time=} or {duration=}: clip id={clip_id}')
+    if results['fills']:
+        sql = 'UPDATE clips SET start_frame=?, duration_seconds=? WHERE id=?'
+        con.executemany(sql, results['fills'])
+        con.commit()
+
+    if stored_sums:
+        accumulators = stored_accumulators(con)
+    else:
+        # Sorted like ORDER BY activity, no activity first.
+        accumulators = sorted(results['accumulators'].items(),
+                              key=lambda item: (item[0] is not None, item[0]))
+    histograms = results['histograms'] if percentiles else None
+    con.close()
+    lines = messages + report_lines(accumulators)
+    if histograms is not None:
+        lines += distribution_lines(histograms, edges)
+    return {
+        'errors': [],
+        'messages': messages,
+        'report': ''.join(f'{line}\n' for line in lines),
+        'accumulators': [[activity, accumulator.to_list()]
+                         for (activity, accumulator) in accumulators],
+        'histograms': None if histograms is None else
+        [[activity, histogram.to_dict()] for (activity, histogram) in histograms.items()]}
+
+
+def stored_accumulators(con):
+    """
+    Returns [(activity, Accumulator)] for the durations of the clips of
+    each activity, in activity order, from the sums that the triggers
+    from schema.py keep in clip_stats.
+    """
+    sql = """SELECT activity, count, total, sum_squares, minimum, maximum
+FROM clip_stats ORDER BY 1"""
+    return [(activity, Accumulator.from_sum_squares(*sums))
+            for (activity, *sums) in con.execute(sql).fetchall()]
 
+
+def report_lines(accumulators):
+    """
+    Returns the lines of the report for the [(activity, Accumulator)],
+    ending with the total merged from them.
+    """
     details = [['Act', 'Secs', 'Count', 'Min', 'Max', 'Avg',  'StdDev', 'Variance']]
-    sql = """SELECT  activity, sum(duration_seconds) "Sum" ,count(duration_seconds) "Count",
-  min(duration_seconds) "Min", max(duration_seconds) "Max",
-  sum(duration_seconds) / count(duration_seconds) "Avg"
-FROM clips GROUP BY activity ORDER BY 1"""
-    cur.execute(sql)
-    for results in cur.fetchall():
-        if not results[1]:
+    total = Accumulator()
+    for (activity, accumulator) in accumulators:
+        total.merge(accumulator)
+        if not accumulator.count:
             continue
-        detail = [results[0], format_time(results[1])] + \
-                 ['\t'.join(f'{r:5.1f}'.lstrip() for r in results[2:])]
-
-        sql = """SELECT AVG((clips.duration_seconds - sub.a) * (clips.duration_seconds - sub.a))
-                   FROM clips, 
-                   (SELECT AVG(duration_seconds) AS a FROM clips) AS sub
-                 WHERE activity = :activity"""
-        cur.execute(sql, {'activity': results[0]})
-        results2 = cur.fetchone()
-        details.append(detail + [f'{math.sqrt(results2[0]):5.1f}',
-                                 f'{results2[0]:5.1f}'])
-    sql = """SELECT  activity, sum(duration_seconds) "Sum" ,count(duration_seconds) "Count",
-  min(duration_seconds) "Min", max(duration_seconds) "Max",
-  sum(duration_seconds) / count(duration_seconds) "Avg"
-FROM clips ORDER BY 1"""
-    cur.execute(sql)
-    results = cur.fetchone()
-    total = results[1]
-    detail = ['Total', format_time(total)] + \
-             ['\t'.join(f'{r:5.1f}'.lstrip() for r in results[2:])]
-
-    sql = """SELECT AVG((clips.duration_seconds - sub.a) * (clips.duration_seconds - sub.a))
-               FROM clips, 
-               (SELECT AVG(duration_seconds) AS a FROM clips) AS sub"""
-    cur.execute(sql)
-    results2 = cur.fetchone()
-    details.append(detail + [f'{math.sqrt(results2[0]):5.1f}',
-                             f'{results2[0]:5.1f}'])
+        details.append(report_row(activity, accumulator))
+    details.append(report_row('Total', total))
 
+    lines = []
     for row in details:
         if len(row[1]) < 8:
             row[1] += '\t'
-        sys.stdout.write(f'{activities[row[0]]:<17s}' if row[0] in activities else
-                         f'{row[0]:<17s}')
-        sys.stdout.write('\t')
-        sys.stdout.write('\t'.join(row[1:]))
-        sys.stdout.write('\n')
+        name = f'{activities[row[0]]:<17s}' if row[0] in activities else f'{row[0]:<17s}'
+        lines.append(name + '\t' + '\t'.join(row[1:]))
+    return lines
 
 
-def to_start_frame(start_time):
+class Accumulator():
     """
-    Convert start_time string to start_frame.
+    Count, total, mean, minimum and maximum of a set of durations, and m2,
+    the sum of the squared differences from the mean. Accumulators of
+    separate sets can be merged into the one for all of them.
     """
-    times = [1, 30, 30 * 60, 30 * 60 * 60]
-    time_index = 0
-    start_frame = 0
-    for part in reversed(start_time.split(':')):
-        start_frame += int(part) * times[time_index]
-        time_index += 1
-    return start_frame
+    def __init__(self, count=0, total=None, m2=None, minimum=None, maximum=None):
+        """
+        Start from the count, sum, m2, min and max of the durations, as
+        SQL returns them, None for no durations.
+        """
+        self.count = count
+        self.total = total or 0.0
+        self.mean = self.total / count if count else 0.0
+        self.m2 = m2 or 0.0
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @classmethod
+    def from_sum_squares(cls, count, total, sum_squares, minimum, maximum):
+        """
+        Make an accumulator from the sum of squares kept in clip_stats
+        instead of m2. The triggers keep that sum because a duration can
+        be added to it and taken out again. m2 is then sum_squares -
+        total * mean, which loses the digits the two have in common, so
+        it is only accurate while the spread of the durations is not tiny
+        compared to their mean. For clips of seconds to minutes there are
+        digits to spare.
+        """
+        mean = total / count if count else 0.0
+        # Rounding can leave this just below 0 when the durations are equal.
+        m2 = max((sum_squares or 0.0) - (total or 0.0) * mean, 0.0)
+        return cls(count, total, m2, minimum, maximum)
 
+    @classmethod
+    def from_values(cls, values):
+        """
+        Make an accumulator from a list of durations, with m2 from the
+        differences to their mean.
+        """
+        if not values:
+            return cls()
+        mean = sum(values) / len(values)
+        return cls(len(values), sum(values), sum((value - mean) ** 2 for value in values),
+                   min(values), max(values))
 
-def to_seconds(string):
+    def merge(self, other):
+        """
+        Add the durations of other to these, using the pairwise update of
+        Chan, Golub and LeVeque for the mean and m2.
+        """
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+        self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+
+    @property
+    def variance(self):
+        """
+        The population variance of the durations.
+        """
+        return self.m2 / self.count if self.count else 0.0
+
+    def to_list(self):
+        """
+        Returns the values kept, in a list that json can store.
+        """
+        return [self.count, self.total, self.mean, self.m2, self.minimum, self.maximum]
+
+    @classmethod
+    def from_list(cls, values):
+        """
+        Make an accumulator from what to_list returned.
+        """
+        accumulator = cls()
+        (accumulator.count, accumulator.total, accumulator.mean, accumulator.m2,
+         accumulator.minimum, accumulator.maximum) = values
+        return accumulator
+
+
+def report_row(activity, accumulator):
+    """
+    Returns the columns of the report for the activity.
+    """
+    return [activity, format_time(accumulator.total),
+            '\t'.join(f'{r:5.1f}'.lstrip() for r in [accumulator.count, accumulator.minimum,
+                                                      accumulator.maximum, accumulator.mean]),
+            f'{math.sqrt(accumulator.variance):5.1f}', f'{accumulator.variance:5.1f}']
+
+
+def distribution_lines(histograms, edges):
     """
-    Look at a seconds string to pull off the components.
-    Returns the number seconds with fractional frames.
+    Returns the lines giving the percentiles and the histogram bin counts
+    of each activity and of all of them, with the bins split at edges.
     """
-    #                s  s    f  f
-    match = re.match(r'^(\d?\d):(\d\d)$', string)
-    if match:
-        hour = 0
-        minutes = 0
-        sec = match.group(1)
-        frame = match.group(2)
+    labels = [f'<{edges[0]:g}'] + [f'{low:g}-{high:g}' for (low, high) in zip(edges, edges[1:])] + \
+        [f'{edges[-1]:g}+']
+    lines = ['\t'.join([f'{"Act":<17s}', 'p50', 'p90', 'p99'] + labels)]
+    total = LogHistogram(edges=edges)
+    rows = []
+    # Sorted like the report, no activity first.
+    for (activity, histogram) in sorted(histograms.items(),
+                                        key=lambda item: (item[0] is not None, item[0])):
+        total.merge(histogram)
+        rows.append((activities.get(activity, activity), histogram))
+    rows.append(('Total', total))
+    for (name, histogram) in rows:
+        percentiles = [f'{histogram.quantile(fraction):5.1f}' for fraction in (0.5, 0.9, 0.99)]
+        lines.append('\t'.join([f'{str(name):<17s}'] + percentiles +
+                                [str(count) for count in histogram.bin_counts]))
+    return lines
+
+
+def scan(con, options, jobs, chunk_size):
+    """
+    Read the clips once, chunk_size at a time, for everything the report
+    needs from them. options is (database_file, check, backfill, sums,
+    edges), telling scan_range what to do. With jobs above 1 the clips
+    are split in ranges of chunk_size ids, read by that many processes.
+    Returns the results of scan_range for all the clips.
+    """
+    (low, high) = con.execute('SELECT min(id), max(id) FROM clips').fetchone()
+    if jobs > 1:
+        # The first and last id of each chunk_size clips, paging by id like
+        # bulk_timecode.backfill, so gaps in the ids make no empty chunks.
+        # Only the ids are read for this.
+        sql = 'SELECT min(id), max(id) FROM (SELECT id FROM clips WHERE id > ? ORDER BY id LIMIT ?)'
+        ranges = []
+        last_id = None if low is None else low - 1
+        while last_id is not None:
+            (low, last_id) = con.execute(sql, (last_id, chunk_size)).fetchone()
+            if low is not None:
+                ranges.append((low, last_id))
     else:
-        #                m  m    s s    f  f
-        match = re.match(r'^(\d?\d):(\d\d):(\d\d)$', string)
-        if match:
-            hour = 0
-            minutes = match.group(1)
-            sec = match.group(2)
-            frame = match.group(3)
-        else:
-            #                     h  h    m  m    s s    f  f
-            match = re.match(r'^(\d?\d):(\d?\d):(\d\d):(\d\d)$', string)
-            if match:
-                hour = match.group(1)
-                minutes = match.group(2)
-                sec = match.group(3)
-                frame = match.group(4)
-            else:
-                return f"Didn't match proper syntax: {string=}"
-    if int(frame) >= 30:
-        return f'Frame too large: {frame} in {string}' % (frame, string)
-    return (int(hour) * 60 + int(minutes)) * 60 + int(sec) + (int(frame) / 30.0)
-
-
-def check_seconds(string):
-    """
-    Look at a seconds string to pull off the components.
-    This only does validation
-    """
-    #                s  s    f  f
-    match = re.match(r'^(\d?\d):(\d\d)$', string)
-    if match:
-        hour = 0
-        minutes = 0
-        sec = match.group(1)
-        frame = match.group(2)
+        ranges = [] if low is None else [(low, high)]
+    tasks = [options + (low, high, chunk_size) for (low, high) in ranges]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            parts = list(executor.map(scan_range, tasks))
     else:
-        #                     m  m    s s    f  f
-        match = re.match(r'^(\d?\d):(\d\d):(\d\d)$', string)
-        if match:
-            hour = 0
-            minutes = match.group(1)
-            sec = match.group(2)
-            frame = match.group(3)
+        parts = list(map(scan_range, tasks))
+    results = empty_results()
+    for part in parts:
+        merge_results(results, part, options[-1])
+    return results
+
+
+def scan_range(task):
+    """
+    Read the clips with ids from low to high, in a process of its own.
+    task is (database_file, check, backfill, sums, edges, low, high,
+    chunk_size).
+    Returns a dict of, in id order, bad_data: the (id, video_id,
+    start_time) of the clips with start times that look wrong, errors:
+    the (message, id, video_id, start_time, duration) of the clips with
+    durations that do not convert, both when checking, fills: the
+    (start_frame, duration_seconds, id) of the clips missing one of them
+    and bad_fills: the (id, start_time, duration) of those that do not
+    convert, both with backfill. With sums accumulators holds the
+    {activity: Accumulator} of the durations, with edges histograms holds
+    the {activity: LogHistogram}.
+    """
+    (database_file, check, backfill, sums, edges, low, high, chunk_size) = task
+    con = sqlite3.connect(database_file)
+    sql = """SELECT clips.id, video_id, activity, start_time, duration, fps,
+  start_frame, duration_seconds
+FROM clips LEFT JOIN videos ON videos.id = video_id
+WHERE clips.id BETWEEN ? AND ? ORDER BY clips.id"""
+    results = empty_results()
+    cur = con.execute(sql, (low, high))
+    while rows := cur.fetchmany(chunk_size):
+        durations = {}
+        for (clip_id, video_id, activity, start_time, duration, fps,
+             start_frame, seconds) in rows:
+            if check and not is_start_time(start_time, fps):
+                results['bad_data'].append((clip_id, video_id, start_time))
+            converted = None
+            if check or seconds is None:
+                try:
+                    converted = to_seconds(duration, fps, duration=True)
+                except Exception as arg:
+                    if check:
+                        results['errors'].append((str(arg), clip_id, video_id, start_time,
+                                                  duration))
+            if backfill and (start_frame is None or seconds is None):
+                try:
+                    if start_frame is None:
+                        start_frame = to_frames(start_time, fps)
+                except Exception:
+                    start_frame = None
+                if start_frame is None or (seconds is None and converted is None):
+                    results['bad_fills'].append((clip_id, start_time, duration))
+                else:
+                    seconds = converted if seconds is None else seconds
+                    results['fills'].append((start_frame, seconds, clip_id))
+            # The duration_seconds the clip has, once the fills are stored.
+            if seconds is not None:
+                durations.setdefault(activity, []).append(seconds)
+        for (activity, values) in durations.items():
+            if sums:
+                results['accumulators'].setdefault(activity, Accumulator()).merge(
+                    Accumulator.from_values(values))
+            if edges is not None:
+                results['histograms'].setdefault(activity, LogHistogram(edges=edges)).add(values)
+    con.close()
+    return results
+
+
+def empty_results():
+    """
+    Returns the results of scanning no clips.
+    """
+    return {'bad_data': [], 'errors': [], 'fills': [], 'bad_fills': [],
+            'accumulators': {}, 'histograms': {}}
+
+
+def merge_results(results, part, edges):
+    """
+    Add the results of scan_range for the clips after those in results.
+    """
+    for key in ('bad_data', 'errors', 'fills', 'bad_fills'):
+        results[key] += part[key]
+    for (activity, accumulator) in part['accumulators'].items():
+        results['accumulators'].setdefault(activity, Accumulator()).merge(accumulator)
+    for (activity, histogram) in part['histograms'].items():
+        results['histograms'].setdefault(activity, LogHistogram(edges=edges)).merge(histogram)
+
+
+def cache_key(database_file, options):
+    """
+    Returns what the report depends on: the path of the database, the file
+    change counter in its header, the size and modification time of the
+    database and of its WAL file, where writes wait for a checkpoint
+    before they reach the database, and the report options. None if the
+    database does not exist.
+    """
+    path = os.path.abspath(database_file)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as db:
+        change_counter = int.from_bytes(db.read(100)[24:28], 'big')
+    files = []
+    for name in (path, path + '-wal'):
+        if os.path.isfile(name):
+            status = os.stat(name)
+            files.append([status.st_size, status.st_mtime_ns])
         else:
-            #                     h  h    m m    s s    f  f
-            match = re.match(r'^(\d?\d):(\d\d):(\d\d):(\d\d)$', string)
-            if match:
-                hour = match.group(1)
-                minutes = match.group(2)
-                sec = match.group(3)
-                frame = match.group(4)
-            else:
-                raise SyntaxError(f"Didn't match: {string=}")
-    if int(frame) >= 30:
-        raise SyntaxError(f'Frame too large: {frame} in {string}')
-    return (int(hour) * 60 + int(minutes)) * 60 + int(sec) + (int(frame) / 30.0)
+            files.append(None)
+    return [path, change_counter, files, options]
+
 
+def read_cache(cache_file, key):
+    """
+    Returns the entry kept in cache_file for key, None if there is none.
+    """
+    if not cache_file or key is None or not os.path.isfile(cache_file):
+        return None
+    try:
+        with open(cache_file, encoding='utf-8') as cache:
+            entries = json.load(cache)
+    except (OSError, ValueError):
+        return None
+    for entry in entries:
+        if entry['key'] == key:
+            return entry
+    return None
 
-def check_start(time):
+
+def write_cache(cache_file, key, entry):
     """
-    Runs re.match on the start time string.
+    Keep entry for key in cache_file. Entries for other databases, and
+    for the same database in the same state with other options, are
+    kept, the others dropped.
     """
-    #                       h    min    m  sec  s  fra  f
-    return re.match(r'^(([123]:)?[0-5])?\d:[0-5]\d:[0-2]\d$', time)
+    if not cache_file or key is None:
+        return
+    entries = []
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, encoding='utf-8') as cache:
+                entries = [old for old in json.load(cache)
+                           if old['key'][0] != key[0] or
+                           (old['key'][:3] == key[:3] and old['key'] != key)]
+        except (OSError, ValueError):
+            pass
+    entries.append(dict(entry, key=key))
+    # Written beside it and renamed, so a reader never sees half a file.
+    with open(cache_file + '.tmp', 'w', encoding='utf-8') as cache:
+        json.dump(entries, cache)
+    os.replace(cache_file + '.tmp', cache_file)
 
 
 def format_time(time):
     """
     Convert time in msec to a formatted string.
     """
-    msec =int(100 * ( time - int(time) ))
-    time = int(time)
+    # Whole hundredths, rounded first so that sums which differ only in
+    # the last bits, like 277.9 and 277.90000000000003, are cut down alike.
+    (time, msec) = divmod(int(round(time * 100, 4)), 100)
     sec = time % 60
     time = time / 60
     minutes = int(time % 60)
@@ -246,7 +569,7 @@ def db_open(database_file):
     """
     Open the database and return a connection object.
     """
-    return sqlite3.connect(database_file)
+    return register_functions(sqlite3.connect(database_file))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,187 @@
+"""
+Conversions for the clip time strings used in the clips table.
+
+Times are written H:MM:SS:FF, leaving off the leading parts that are 0,
+so 5:03 is 5 seconds and 3 frames and 1:05:03 is 1 minute, 5 seconds and
+3 frames. There are FPS frames per second, unless the fps of the video
+is given. For 29.97 and 59.94 fps videos the times are drop-frame
+timecode: the frame numbers 0 and 1 (0 to 3 at 59.94) are left out at
+the start of every minute that is not a multiple of 10, so that the
+times keep up with the clock. That only applies to start times, which
+label a frame of the video. Durations count frames at 30 or 60 a second
+whatever the fps, so a 1:00:00 duration is 1800 frames at 29.97 fps.
+
+These run on every row of the clips table, so the strings are taken
+apart with str.split and dictionary lookups instead of regular
+expressions. bench_timecode.py measures the difference.
+"""
+
+from functools import partial
+import re
+
+
+FPS = 30
+
+# Frames in a frame, second, minute and hour at FPS.
+MULTIPLIERS = [1, FPS, FPS * 60, FPS * 60 * 60]
+
+# Parts of a time string and their values. Looking the parts up checks
+# them and converts them in one step, which is faster than a regular
+# expression followed by int().
+TWO_DIGITS = {f'{value:02d}': value for value in range(100)}
+LEADING = dict(TWO_DIGITS, **{str(value): value for value in range(10)})
+
+#                            h    min    m  sec  s fra
+START_PATTERN = re.compile(r'^(([123]:)?[0-5])?\d:[0-5]\d:\d\d$')
+
+# (frames per second in the times, frames dropped per minute) by fps.
+FRAME_RATES = {None: (FPS, 0), FPS: (FPS, 0)}
+
+
+class TimecodeError(ValueError):
+    """
+    Raised for a time string that is not S:FF, M:SS:FF or H:M:SS:FF.
+    """
+
+
+def frame_rate(fps):
+    """
+    Returns (frames per second in the times, frames dropped per minute)
+    for a video with the given fps, which may be None for FPS.
+    Raises ValueError for an fps that does not round to at least 1.
+    """
+    if fps not in FRAME_RATES:
+        nominal = round(fps)
+        if nominal < 1:
+            raise ValueError(f'Bad fps: {fps}')
+        drop = 0
+        # 30000/1001 and 60000/1001 fps.
+        if nominal in (30, 60) and abs(fps - nominal * 1000 / 1001) < 0.005:
+            drop = nominal // 15
+        FRAME_RATES[fps] = (nominal, drop)
+    return FRAME_RATES[fps]
+
+
+def parse(time_string, fps=FPS, duration=False):
+    """
+    Split a time string into (hours, minutes, seconds, frames) ints.
+    The leading part may have 1 or 2 digits, as may the minutes of
+    H:M:SS:FF. All other parts have 2 digits. A duration may have the
+    frame numbers that drop-frame timecode leaves out of start times.
+    """
+    parts = time_string.split(':')
+    try:
+        if len(parts) == 2:
+            values = (0, 0, LEADING[parts[0]], TWO_DIGITS[parts[1]])
+        elif len(parts) == 3:
+            values = (0, LEADING[parts[0]], TWO_DIGITS[parts[1]], TWO_DIGITS[parts[2]])
+        elif len(parts) == 4:
+            values = (LEADING[parts[0]], LEADING[parts[1]],
+                      TWO_DIGITS[parts[2]], TWO_DIGITS[parts[3]])
+        else:
+            values = None
+    except KeyError:
+        values = None
+    if values is None:
+        raise TimecodeError(f"Didn't match: {time_string=}")
+    (nominal, drop) = frame_rate(fps)
+    if values[3] >= nominal:
+        raise TimecodeError(f'Frame too large: {values[3]} in {time_string}')
+    if drop and not duration and values[3] < drop and values[2] == 0 and values[1] % 10:
+        raise TimecodeError(f'Dropped frame: {time_string}')
+    return values
+
+
+def to_frames(time_string, fps=FPS, duration=False):
+    """
+    Convert a time string to a number of frames. For a start time this is
+    the frame it labels, for a duration the frames it counts.
+    """
+    (hour, minute, sec, frame) = parse(time_string, fps, duration)
+    (nominal, drop) = frame_rate(fps)
+    if duration:
+        drop = 0
+    minutes = hour * 60 + minute
+    return (minutes * 60 + sec) * nominal + frame - drop * (minutes - minutes // 10)
+
+
+def to_seconds(time_string, fps=FPS, duration=False):
+    """
+    Convert a time string to seconds, with the frames as a fraction.
+    """
+    (nominal, drop) = frame_rate(fps)
+    if fps is None or (fps == nominal and not drop):
+        (hour, minute, sec, frame) = parse(time_string, fps, duration)
+        return (hour * 60 + minute) * 60 + sec + (frame / float(nominal))
+    return to_frames(time_string, fps, duration) / fps
+
+
+def to_string(frames, fps=FPS, duration=False):
+    """
+    Convert a number of frames to a time string, leaving off the leading
+    parts that are 0. This is the inverse of to_frames.
+    """
+    if frames < 0:
+        raise TimecodeError(f'Negative time: {frames} frames')
+    (nominal, drop) = frame_rate(fps)
+    if drop and not duration:
+        # Put back the frame numbers left out before this frame.
+        (tens, rest) = divmod(frames, nominal * 600 - drop * 9)
+        frames += drop * 9 * tens
+        if rest >= drop:
+            frames += drop * ((rest - drop) // (nominal * 60 - drop))
+    (rest, frame) = divmod(frames, nominal)
+    (rest, sec) = divmod(rest, 60)
+    (hour, minute) = divmod(rest, 60)
+    if hour:
+        return f'{hour}:{minute:02d}:{sec:02d}:{frame:02d}'
+    if minute:
+        return f'{minute}:{sec:02d}:{frame:02d}'
+    return f'{sec}:{frame:02d}'
+
+
+def is_start_time(time_string, fps=FPS):
+    """
+    True if time_string looks like a clip start time: M:SS:FF, MM:SS:FF or
+    H:MM:SS:FF up to 3 hours, with minutes and seconds below 60 and frames
+    below the frames per second.
+    """
+    try:
+        nominal = frame_rate(fps)[0]
+    except ValueError:
+        return False
+    return START_PATTERN.match(time_string) is not None and int(time_string[-2:]) < nominal
+
+
+def sql_function(function):
+    """
+    Wrap a conversion for use in SQL, returning NULL for values that do
+    not convert instead of raising.
+    """
+    def wrapper(*values):
+        try:
+            return function(*values)
+        except (ValueError, TypeError, AttributeError):
+            return None
+    return wrapper
+
+
+def register_functions(con):
+    """
+    Make tc_seconds(time), tc_frames(time) and tc_string(frames) available
+    in SQL run on the connection con, so conversions can be done inside
+    the database, and tc_duration_seconds, tc_duration_frames and
+    tc_duration_string, the same for durations. Each also takes the fps as
+    a second argument, which may be NULL for FPS. They are deterministic,
+    so SQlite can use them in indexes and triggers.
+    Returns con.
+    """
+    for (name, function) in [('seconds', to_seconds), ('frames', to_frames),
+                             ('string', to_string)]:
+        for arguments in (1, 2):
+            con.create_function(f'tc_{name}', arguments, sql_function(function),
+                                deterministic=True)
+            con.create_function(f'tc_duration_{name}', arguments,
+                                sql_function(partial(function, duration=True)),
+                                deterministic=True)
+    return con
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Check the clips of every video against each other and against the length
+of the video. Reported are:
+
+  overlap    a clip starting before an earlier one ends
+  duplicate  a clip with the same start, duration and activity as another
+  past_end   a clip running past the end of the video
+  bad_time   a clip whose start_time or duration does not convert
+  gap        with --min_gap, time between clips that no clip covers
+
+The frames missing from clips without the triggers of schema.py are
+filled in first. Then the clips are read once, in order of video and
+start frame from the index that schema.py adds, made here if missing,
+and each video is checked in one pass, keeping the clip that ends last
+so far. Each problem is printed as it is found as
+kind|clip id|video id|filename|detail. The video lengths come from
+probe_videos.py or video_clip.py. The exit status is 1 when anything
+other than gaps was found.
+"""
+
+import argparse
+import sqlite3
+import sys
+
+from schema import add_columns
+from timecode import FPS, register_functions, to_string
+
+
+def build_parser():
+    """
+    Command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.strip())
+
+    parser.add_argument('-d', '--database_file', default='example.db',
+                        help='File name of the SQlite database file. '
+                        'default: %(default)s')
+
+    parser.add_argument('-g', '--min_gap', type=float, default=0,
+                        help='Report gaps between clips of at least this many seconds. '
+                        '0 does not report gaps. '
+                        'default: %(default)s')
+
+    return parser
+
+
+def main(args):
+    """
+    Main processing function.
+    """
+    con = db_open(args.database_file)
+    add_columns(con, 'clips', [('duration_frames', 'INTEGER')])
+    add_columns(con, 'videos', [('fps', 'REAL'), ('length_frames', 'INTEGER')])
+    problems = 0
+    for (kind, clip_id, video_id, filename, detail) in check_clips(con, args.min_gap):
+        print(f'{kind}|{clip_id}|{video_id}|{filename}|{detail}')
+        if kind != 'gap':
+            problems += 1
+    if problems:
+        sys.exit(1)
+
+
+def check_clips(con, min_gap=0):
+    """
+    Yield (kind, clip id, video id, filename, detail) for each problem
+    found, video by video.
+    """
+    # Fill in the frames missing without the triggers from schema.py, so
+    # the order comes from the clips_video_start index and not from sorting
+    # computed values. The ones that do not convert stay NULL.
+    fps = '(SELECT fps FROM videos WHERE videos.id = clips.video_id)'
+    con.execute('CREATE INDEX IF NOT EXISTS clips_video_start ON clips (video_id, start_frame)')
+    con.execute(f"""UPDATE clips SET start_frame = tc_frames(start_time, {fps})
+WHERE start_frame IS NULL""")
+    con.execute(f"""UPDATE clips SET duration_frames = tc_duration_frames(duration, {fps})
+WHERE duration_frames IS NULL""")
+    con.commit()
+    # Same start, length and activity next to each other, for duplicates.
+    sql = """SELECT clips.id, video_id, filename, fps, length_frames, activity,
+       start_time, duration, start_frame, duration_frames
+FROM clips LEFT JOIN videos ON videos.id = video_id
+ORDER BY video_id, start_frame, duration_frames, activity, clips.id"""
+    video_id = None
+    for (clip_id, clip_video_id, filename, fps, video_length, activity,
+         start_time, duration, start, length) in con.execute(sql):
+        if clip_video_id != video_id:
+            video_id = clip_video_id
+            # The clip that ends last so far and where it ends.
+            (last_id, last_end) = (None, 0)
+            previous = None
+        if start is None or length is None:
+            yield ('bad_time', clip_id, video_id, filename, f'{start_time} + {duration}')
+            continue
+        end = start + length
+        if (start, length, activity) == previous:
+            yield ('duplicate', clip_id, video_id, filename, f'of clip {previous_id}')
+        elif start < last_end:
+            yield ('overlap', clip_id, video_id, filename,
+                   f'{start_time} starts {to_string(last_end - start, fps, duration=True)} '
+                   f'before clip {last_id} ends')
+        elif min_gap and start - last_end >= min_gap * (fps or FPS):
+            yield ('gap', clip_id, video_id, filename,
+                   f'{to_string(start - last_end, fps, duration=True)} before {start_time}')
+        if video_length is not None and end > video_length:
+            yield ('past_end', clip_id, video_id, filename,
+                   f'{start_time} + {duration} ends '
+                   f'{to_string(end - video_length, fps, duration=True)} '
+                   'after the video')
+        if end > last_end:
+            (last_id, last_end) = (clip_id, end)
+        (previous, previous_id) = ((start, length, activity), clip_id)
+
+
+def db_open(db_file):
+    """
+    Open the database and return a connection object.
+    """
+    return register_functions(sqlite3.connect(db_file))
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
@@ -17,43 +17,25 @@ Look at the README file for usage instructions.
 # VisiPics can be used to detect duplicates. A sample command is:
 #
 # magick convert 'input.mpg[5]' -resize 400x400 thumbnail.jpg
+#
+# near_duplicates.py does this comparison on sampled frames for the whole
+# database.
 
 import argparse
-from datetime import date, datetime, timedelta
+from datetime import date
 import os
 from pathlib import Path
 import re
 import sqlite3
-import subprocess
 import sys
 
 import pyperclip
 
+from probe_videos import probe
+from schema import add_columns
+import timecode
 
-# ffprobe generates the duration with decimal fractions .00 - .99.
-# We need frames instead. This maps a decimal fraction to a frame number.
-fraction_to_frame = {
-    .00: '00', .01: '00', .02: '00', .03: '01', .04: '01',
-    .05: '01', .06: '02', .07: '02', .08: '02', .09: '03',
-    .10: '03', .11: '03', .12: '03', .13: '04', .14: '04',
-    .15: '04', .16: '05', .17: '05', .18: '05', .19: '06',
-    .20: '06', .21: '06', .22: '06', .23: '07', .24: '07',
-    .25: '07', .26: '07', .27: '08', .28: '08', .29: '08',
-    .30: '09', .31: '09', .32: '10', .33: '10', .34: '10',
-    .35: '10', .36: '10', .37: '11', .38: '11', .39: '11',
-    .40: '12', .41: '12', .42: '12', .43: '13', .44: '13',
-    .45: '13', .46: '13', .47: '14', .48: '14', .49: '14',
-    .50: '15', .51: '15', .52: '15', .53: '15', .54: '16',
-    .55: '16', .56: '16', .57: '16', .58: '17', .59: '17',
-    .60: '17', .61: '18', .62: '18', .63: '18', .64: '19',
-    .65: '19', .66: '19', .67: '19', .68: '20', .69: '20',
-    .70: '21', .71: '21', .72: '22', .73: '22', .74: '22',
-    .75: '22', .76: '23', .77: '23', .78: '23', .79: '24',
-    .80: '24', .81: '24', .82: '24', .83: '25', .84: '25',
-    .85: '25', .86: '26', .87: '26', .88: '26', .89: '26',
-    .90: '27', .91: '27', .92: '27', .93: '27', .94: '28',
-    .95: '28', .96: '29', .97: '29', .98: '29', .99: '29',
-}
+FFPROBE = 'C:/Program Files/ImageMagick-7.1.1-Q16-HDRI/ffprobe'
 
 
 def build_parser():
@@ -126,6 +108,17 @@ class Clips():
             results = cur.fetchone()
 
 
+def clips_at(con, video_id, frame):
+    """
+    Returns (id, start_time, duration, activity) for the clips of the video
+    that cover the given frame, using the index on (video_id, start_frame).
+    """
+    sql = """SELECT id, start_time, duration, activity FROM clips
+WHERE video_id = :video_id AND start_frame <= :frame AND start_frame + duration_frames > :frame
+ORDER BY start_frame"""
+    return con.execute(sql, {'video_id': video_id, 'frame': frame}).fetchall()
+
+
 class VideoClipData():
     """
     Retrieve data from the user and store in the database.
@@ -135,7 +128,21 @@ class VideoClipData():
         """Initializes the data structures."""
         self.activity = args.activity
         self.videos_dir = args.videos_dir
-        self.con = sqlite3.connect(args.database_file)
+        # The functions are needed by the triggers installed by schema.py.
+        self.con = timecode.register_functions(sqlite3.connect(args.database_file))
+        add_columns(self.con, 'clips', [('duration_frames', 'INTEGER')])
+        add_columns(self.con, 'videos', [('fps', 'REAL'), ('length_frames', 'INTEGER')])
+        # clips_at needs the frames of every clip and the index on them, like
+        # validate_clips.py. Without the triggers from schema.py the clips
+        # stored before these columns have none.
+        fps = '(SELECT fps FROM videos WHERE videos.id = clips.video_id)'
+        self.con.execute('CREATE INDEX IF NOT EXISTS clips_video_start '
+                         'ON clips (video_id, start_frame)')
+        self.con.execute(f"""UPDATE clips SET start_frame = tc_frames(start_time, {fps})
+WHERE start_frame IS NULL""")
+        self.con.execute(f"""UPDATE clips SET duration_frames = tc_duration_frames(duration, {fps})
+WHERE duration_frames IS NULL""")
+        self.commit()
         db_files = self.get_files_from_db()
         self.disk_files = self.get_files_from_disk()
         self.available_files = [(file, self.disk_files.index(file))
@@ -267,13 +274,20 @@ class VideoClipData():
         treat it as the initial start time.
         """
         activity = self.activity
-        sql = """INSERT INTO clips (video_id, start_time, duration, activity, mag) VALUES (
-    :video_id, :start_time, :duration, :activity, :mag)"""
+        sql = """INSERT INTO clips (video_id, start_time, duration, activity, mag,
+                   start_frame, duration_frames) VALUES (
+    :video_id, :start_time, :duration, :activity, :mag, :start_frame, :duration_frames)"""
         clip_number = 1
         # Auto fill for MM: or HH:MM:
         auto_fill_time = '0:'
-        time_remaining = get_clip_length(str(Path(self.videos_dir) / self.filename))
+        (time_remaining, fps, length_frames) = get_clip_length(
+            str(Path(self.videos_dir) / self.filename))
         print(f'{time_remaining=}')
+        # The times typed in count frames at the rate of the video.
+        self.con.execute('UPDATE videos SET fps = :fps, length_frames = :length_frames '
+                         'WHERE id = :id', {'fps': fps, 'id': self.video.id,
+                                            'length_frames': length_frames})
+        self.commit()
         while True:
             if initial_start_time:
                 # Set start time (was a comment) and fix common data entry errors.
@@ -298,7 +312,13 @@ class VideoClipData():
                     # Now nn:nn
                     start_time = auto_fill_time + start_time
 
-            end_duration = subtract_time(time_remaining, start_time)
+            start_frame = to_frame(start_time, fps)
+            for (clip_id, other_start, other_duration, other_activity) in \
+                    clips_at(self.con, self.video.id, start_frame):
+                print(f'Warning: inside clip {clip_id} {other_start} + {other_duration} '
+                      f'{other_activity}')
+
+            end_duration = subtract_time(time_remaining, start_time, fps)
             sys.stdout.write(f'duration ({end_duration}): ')
             sys.stdout.flush()
             duration   = sys.stdin.readline().strip()
@@ -309,8 +329,9 @@ class VideoClipData():
             duration = ':'.join([f'{int_safe(part):02d}'
                                  for part in duration.split(':')]).lstrip('0')
 
+            duration_frames = to_frame(duration, fps, duration=True)
             # compute using start_time + duration adding ':'
-            auto_parts = from_frame(to_frame(start_time) + to_frame(duration)).rsplit(':', 2)
+            auto_parts = from_frame(start_frame + duration_frames, fps).rsplit(':', 2)
             print(f'{auto_parts=}, {start_time=}, {duration=}')
             if len(auto_parts) > 2:
                 auto_fill_time = ':'.join(auto_parts[0:len(auto_parts) - 2]) + ':'
@@ -343,6 +364,8 @@ class VideoClipData():
                       'duration': duration,
                       'activity': activity,
                       'mag': mag,
+                      'start_frame': start_frame,
+                      'duration_frames': duration_frames,
                       'video_id': self.video.id}
             retry = True
             while retry:
@@ -378,47 +401,46 @@ def int_safe(value):
     return integer
 
 
-def to_frame(time):
+def to_frame(time, fps=timecode.FPS, duration=False):
     """
-    Convert a time in h:mm:ss:ff or m:ss:ff format to a frame int.
+    Convert a time in h:mm:ss:ff or m:ss:ff format to a frame int, the
+    frames it counts if duration is True.
+    Typed in times that timecode does not accept are still converted,
+    treating empty parts as 0 and warning about bad ones, but without
+    the frames left out by drop-frame timecode.
     """
+    try:
+        return timecode.to_frames(time, fps, duration)
+    except timecode.TimecodeError:
+        pass
+    nominal = timecode.frame_rate(fps)[0]
     time_splits = time.split(':')
     time_splits.reverse()
-    #                        F  S   M        H
-    zips = zip(time_splits, [1, 30, 30 * 60, 30 * 60 * 60])
+    zips = zip(time_splits, [1, nominal, nominal * 60, nominal * 60 * 60])
     return sum(int_safe(factor) * value for (factor, value) in zips if factor != '')
 
 
-def from_frame(frames):
+def from_frame(frames, fps=timecode.FPS, duration=False):
     """
-    Convert frames to HH:MM:SS with leading 0s removed.
+    Convert frames to HH:MM:SS:FF with leading 0s removed, as a start
+    time or as a duration.
     """
-    hhmmss = (datetime(2000, 1, 2) + timedelta(seconds=int(frames / 30))).strftime('%H:%M:%S')
-    return hhmmss.lstrip('0:') + f':{(frames % 30):02d}'
+    return timecode.to_string(frames, fps, duration)
 
 
 def get_clip_length(filename):
     """
-    Use ffprobe to get the length of a clip. Returns a time string.
+    Use ffprobe to get the frame rate and the length of a clip, exactly
+    like probe_videos.py, 30000/1001 for 29.97 fps.
+    Returns (time string, fps, length in frames).
     """
-    result = subprocess.Popen(["C:/Program Files/ImageMagick-7.1.1-Q16-HDRI/ffprobe",
-                               filename],
-                              stdout = subprocess.PIPE,
-                              text=True,
-                              stderr = subprocess.STDOUT)
-    # Look for a line like this:
-    #   Duration: 00:00:24.03, start: 0.000000, bitrate: 3485 kb/s
-    raw_time = [x.split(',')[0].split()[1] for x in result.stdout.readlines() if "Duration" in x][0]
-    parts = raw_time.replace('.', ':').split(':')
-    # Use fraction_to_frame to convert decimal fractions to frame numbers.
-    frame = fraction_to_frame[float(f'0.{parts[-1]}')]
-    parts[-1] = frame
-    almost = ':'.join(parts).replace('00:', '').lstrip('0')
-    if not almost:
-        almost = '0:00'
-    if ':' not in almost:
-        almost = f'0.{int(almost):02d}'
-    return almost
+    (fps, length_frames) = probe(FFPROBE, filename)
+    if fps is None:
+        # No rate for a stream ffprobe cannot read.
+        fps = timecode.FPS
+    if length_frames is None:
+        sys.exit(f'Error: no length for {filename}.')
+    return (from_frame(length_frames, fps), fps, length_frames)
 
 
 def normalize_time(time_string):
@@ -433,45 +455,24 @@ def normalize_time(time_string):
     return time_string
 
 
-def subtract_time(minuend, subtrahend):
+def subtract_time(minuend, subtrahend, fps=timecode.FPS):
     """
-    Compute minuend - subtrahend, both strings.
-    Returns a string.
+    Compute minuend - subtrahend, both start time strings.
+    Returns the duration string between them.
     """
-    minuend = [int_safe(x) for x in normalize_time(minuend).split(':')]
-    subtrahend = [int_safe(x) for x in normalize_time(subtrahend).split(':')]
-    # Do frames first
-    frame_diff = minuend[-1] - subtrahend[-1]
-    if frame_diff < 0:
-        # have to borrow from seconds.
-        minuend[-2] -= 1
-        frame_diff += 30
-    diffs = [frame_diff]
-    for index in [2, 1, 0]:
-        diff = minuend[index] - subtrahend[index]
-        if diff < 0:
-            if index == 0:
-                # Nothing to borrow from.
-                raise ArithmeticError(f'underflow {minuend} - {subtrahend}')
-            diff += 60
-            minuend[index - 1] -= 1
-        diffs = [diff] + diffs
-    return array_to_time(diffs)
+    frames = to_frame(minuend, fps) - to_frame(subtrahend, fps)
+    if frames < 0:
+        raise ArithmeticError(f'underflow {minuend} - {subtrahend}')
+    return from_frame(frames, fps, duration=True)
 
 
 def array_to_time(array):
     """
-    Convert array to a time string, removing leading 0s.
+    Convert an [hours, minutes, seconds, frames] array to a time string,
+    removing leading 0s.
     """
-    time_string = ':'.join([f'{element:02d}' for element in array]) \
-                     .replace(':0', ':') \
-                     .replace('00:', '')
-    if time_string.startswith('0'):
-        time_string = time_string[1:]
-    if time_string[-2] == ':':
-        # last time element must have 2 digits, add leading 0.
-        time_string = time_string[0:-2] + ':0' + time_string[-1]
-    return time_string.lstrip(':')
+    return from_frame(sum(value * multiplier
+                          for (value, multiplier) in zip(reversed(array), timecode.MULTIPLIERS)))
 
 
 def main(args):